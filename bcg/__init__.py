@@ -2,17 +2,31 @@
 # -*- coding: utf-8 -*-
 import sys
 import os
+import time
 import click
 import click_log
 import logging
-from bcg.gateway import Gateway
-from bcg.utils import *
-from bcg.config import load_config
 
 __version__ = '@@VERSION@@'
 
 logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s')
-log_level_lut = {'D': 'debug', 'I': 'info', 'W': 'warning', 'E': 'error'}
+
+# names the package exported before its modules were loaded lazily
+_LAZY = {
+    'Gateway': 'bcg.gateway',
+    'log_level_lut': 'bcg.logfwd',
+    'load_config': 'bcg.config',
+    'device_configs': 'bcg.config',
+    'get_devices': 'bcg.utils',
+}
+
+
+def __getattr__(name):
+    module = _LAZY.get(name)
+    if module is None:
+        raise AttributeError('module %r has no attribute %r' % (__name__, name))
+    import importlib
+    return getattr(importlib.import_module(module), name)
 
 
 @click.group(invoke_without_command=True)
@@ -37,48 +51,174 @@ def cli(ctx, config_file, device, mqtt_host, mqtt_port, no_wait, mqtt_username,
     if debug:
         logging.getLogger().setLevel(logging.DEBUG)
 
+    ctx.obj = ctx.params
+
     if ctx.invoked_subcommand:
         return
 
-    config = load_config(config_file)
+    config = cli_config(ctx.obj)
+
+    if not config.get('device', None) and not config.get('devices', None):
+        click.echo('The following arguments are required: -d/--device or -c/--config')
+        click.echo('Tip: for show available devices use command: bcg devices')
+        sys.exit(1)
+
+    gateway = gateway_create(config)
+
+    if config_file is not None and os.path.isfile(config_file.name):
+        from bcg.reload import ConfigReloader
+
+        def load():
+            with open(config_file.name, 'r') as f:
+                return cli_config(dict(ctx.obj, config_file=f))
+
+        gateway.watch_config(ConfigReloader(config_file.name, load, gateway.config_reload, config['reload_interval']))
+
+    try:
+        gateway.start(not no_wait)
+    except KeyboardInterrupt as e:
+        return
+
+
+def cli_config(params):
+    from bcg.config import load_config
+
+    config = load_config(params['config_file'])
+
+    if params['device']:
+        config['device'] = params['device']
+        config.pop('devices', None)
+
+    if params['mqtt_host']:
+        config['mqtt']['host'] = params['mqtt_host']
+
+    if params['mqtt_port']:
+        config['mqtt']['port'] = params['mqtt_port']
+
+    if params['mqtt_username']:
+        config['mqtt']['username'] = params['mqtt_username']
+
+    if params['mqtt_password']:
+        config['mqtt']['password'] = params['mqtt_password']
 
-    if device:
-        config['device'] = device
+    if params['mqtt_cafile']:
+        config['mqtt']['mqtt_cafile'] = params['mqtt_cafile']
 
-    if mqtt_host:
-        config['mqtt']['host'] = mqtt_host
+    if params['mqtt_certfile']:
+        config['mqtt']['certfile'] = params['mqtt_certfile']
 
-    if mqtt_port:
-        config['mqtt']['port'] = mqtt_port
+    if params['mqtt_keyfile']:
+        config['mqtt']['keyfile'] = params['mqtt_keyfile']
 
-    if mqtt_username:
-        config['mqtt']['username'] = mqtt_username
+    if params['retain_node_messages']:
+        config['retain'] = params['retain_node_messages']
 
-    if mqtt_password:
-        config['mqtt']['password'] = mqtt_password
+    return config
 
-    if mqtt_cafile:
-        config['mqtt']['mqtt_cafile'] = mqtt_cafile
 
-    if mqtt_certfile:
-        config['mqtt']['certfile'] = mqtt_certfile
+def gateway_create(config):
+    if config.get('devices', None):
+        from bcg.config import device_configs
+        from bcg.pool import GatewayPool
+        return GatewayPool(config, device_configs(config))
+    if config['engine'] == 'asyncio':
+        from bcg.aio import AsyncioGateway
+        return AsyncioGateway(config)
+    from bcg.gateway import Gateway
+    return Gateway(config)
 
-    if mqtt_keyfile:
-        config['mqtt']['keyfile'] = mqtt_keyfile
 
-    if retain_node_messages:
-        config['retain'] = retain_node_messages
+@cli.command('record')
+@click.argument('capture_file', type=click.Path(dir_okay=False, writable=True))
+@click.pass_context
+def command_record(ctx, capture_file):
+    '''Run the gateway and append the serial traffic to a capture file.'''
+    from bcg.capture import CaptureWriter
+
+    config = cli_config(ctx.obj)
 
     if not config.get('device', None):
-        click.echo('The following arguments are required: -d/--device or -c/--config')
-        click.echo('Tip: for show available devices use command: bcg devices')
+        click.echo('The following arguments are required: -d/--device or device in config')
         sys.exit(1)
+    config.pop('devices', None)
 
+    gateway = gateway_create(config)
+    gateway.capture = CaptureWriter(capture_file)
+    logging.info('Recording to %s', capture_file)
     try:
-        gateway = Gateway(config)
-        gateway.start(not no_wait)
+        gateway.start(not ctx.obj['no_wait'])
+    except KeyboardInterrupt as e:
+        pass
+    finally:
+        gateway.capture.close()
+        logging.info('Recorded %d chunks', gateway.capture.chunks)
+
+
+@cli.command('replay')
+@click.argument('capture_file', type=click.Path(exists=True, dir_okay=False))
+@click.option('--speed', '-s', type=float, default=1.0, show_default=True, help='Replay speed factor, 0 for as fast as possible.')
+@click.pass_context
+def command_replay(ctx, capture_file, speed):
+    '''Feed a capture file to the gateway in place of the serial port.'''
+    from bcg.capture import ReplaySerial
+    from bcg.gateway import Gateway
+
+    if speed < 0:
+        raise click.BadParameter('must not be negative', param_hint='--speed')
+
+    config = cli_config(ctx.obj)
+    config['device'] = capture_file
+    config['engine'] = 'thread'
+    config.pop('devices', None)
+
+    gateway = Gateway(config)
+    gateway.serial_class = lambda *args, **kwargs: ReplaySerial(*args, speed=speed, ready=lambda: gateway.connected, **kwargs)
+    started = time.monotonic()
+    try:
+        gateway.start(False)
     except KeyboardInterrupt as e:
         return
+    gateway.mqtt_wait_published(10)
+    logging.info('Replayed %s in %.3f s', capture_file, time.monotonic() - started)
+
+
+def export_time(ctx, param, value):
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    from datetime import datetime
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        raise click.BadParameter('expected seconds since the epoch or ISO 8601 time, e.g. 2024-01-31T12:00')
+
+
+@cli.command('export')
+@click.option('--name', '-n', help='Gateway name, default from the configuration.')
+@click.option('--directory', type=click.Path(exists=True, file_okay=False), help='Sink directory instead of the one of the gateway.')
+@click.option('--since', callback=export_time, help='Start time, seconds since the epoch or ISO 8601.')
+@click.option('--until', callback=export_time, help='End time (excluded), seconds since the epoch or ISO 8601.')
+@click.option('--node', 'nodes', multiple=True, help='Node id or alias, can be repeated.')
+@click.option('--output', '-o', default='-', type=click.Path(dir_okay=False, writable=True, allow_dash=True), help='Output file, default stdout.')
+@click.pass_context
+def command_export(ctx, name, directory, since, until, nodes, output):
+    '''Write the node messages of the local sink as NDJSON lines [timestamp, id, alias, subtopic, value].'''
+    from bcg.sink import export
+
+    if directory is None:
+        if name is None:
+            name = cli_config(ctx.obj).get('name')
+        if not name or '{' in name:
+            click.echo('The following arguments are required: -n/--name or --directory')
+            sys.exit(1)
+        import appdirs
+        directory = os.path.join(appdirs.user_data_dir('bcg-' + name), 'sink')
+
+    with click.open_file(output, 'w') as f:
+        f.writelines(export(directory, since, until, set(nodes) if nodes else None))
 
 
 @cli.command('devices')
@@ -86,6 +226,8 @@ def cli(ctx, config_file, device, mqtt_host, mqtt_port, no_wait, mqtt_username,
 @click.option('-s', '--include-links', is_flag=True, help='Include entries that are symlinks to real devices')
 def command_devices(verbose=False, include_links=False):
     '''Print available devices.'''
+    from bcg.utils import get_devices
+
     for port, desc, hwid in get_devices(include_links):
         sys.stdout.write("{:20}\n".format(port))
         if verbose:
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import json
+import time
+from bcg.topic import TopicMatcher
+
+
+class _Rule:
+    __slots__ = ('window', 'suffix', 'passthrough')
+
+    def __init__(self, rule):
+        self.window = rule['window']
+        self.suffix = rule.get('suffix', 'aggregate')
+        self.passthrough = rule.get('passthrough', False)
+
+
+class _Window:
+    __slots__ = ('end', 'count', 'min', 'max', 'sum')
+
+    def __init__(self, end, value):
+        self.end = end
+        self.count = 1
+        if isinstance(value, list):
+            self.min = list(value)
+            self.max = list(value)
+            self.sum = list(value)
+        else:
+            self.min = self.max = self.sum = value
+
+    def add(self, value):
+        if isinstance(self.sum, list):
+            if not isinstance(value, list) or len(value) != len(self.sum):
+                return False
+            for i, v in enumerate(value):
+                if v < self.min[i]:
+                    self.min[i] = v
+                elif v > self.max[i]:
+                    self.max[i] = v
+                self.sum[i] += v
+        else:
+            if isinstance(value, list):
+                return False
+            if value < self.min:
+                self.min = value
+            elif value > self.max:
+                self.max = value
+            self.sum += value
+        self.count += 1
+        return True
+
+    def summary(self, window):
+        if isinstance(self.sum, list):
+            mean = [round(s / self.count, 6) for s in self.sum]
+        else:
+            mean = round(self.sum / self.count, 6)
+        return {'min': self.min, 'max': self.max, 'mean': mean, 'count': self.count, 'window': window}
+
+
+def _value(payload):
+    """Return the number or list of numbers in the encoded payload, None for anything else"""
+    try:
+        value = json.loads(payload)
+    except ValueError:
+        return None
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    if isinstance(value, list) and value and all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in value):
+        return value
+    return None
+
+
+class Aggregator:
+    """Collect numeric node messages of matching topics into time windows.
+
+    The first message of a topic opens a window of the rule's length, every
+    message until its end only updates count, min, max and sum. The closed
+    window is passed once as {min, max, mean, count, window} to publish with
+    the topic and the rule suffix. Payloads which are not numbers or lists of numbers
+    are left to the normal publish.
+    """
+
+    def __init__(self, rules, publish, prefix=''):
+        rules = [(prefix + rule['topic'], _Rule(rule)) for rule in rules]
+        self._matcher = TopicMatcher(rules)
+        self._publish = publish
+        self._windows = {}
+        self.interval = min([1.0] + [rule.window / 2 for _, rule in rules])
+
+    def __bool__(self):
+        return bool(self._matcher)
+
+    def add(self, topic, payload, now=None):
+        """Return True if the message was consumed and should not be published as is"""
+        rule = self._matcher.match(topic)
+        if rule is None:
+            return False
+
+        value = _value(payload)
+        if value is None:
+            return False
+
+        if now is None:
+            now = time.monotonic()
+
+        window = self._windows.get(topic)
+        if window is not None and (now >= window.end or not window.add(value)):
+            self._close(topic, rule)
+            window = None
+        if window is None:
+            self._windows[topic] = _Window(now + rule.window, value)
+
+        return not rule.passthrough
+
+    def flush(self, now=None):
+        """Publish all windows which have ended"""
+        if now is None:
+            now = time.monotonic()
+        for topic in [topic for topic, window in self._windows.items() if now >= window.end]:
+            self._close(topic, self._matcher.match(topic))
+
+    def _close(self, topic, rule):
+        window = self._windows.pop(topic)
+        self._publish(topic, rule.suffix, window.summary(rule.window))
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import time
+import asyncio
+import logging
+import threading
+import serial
+import paho.mqtt
+from looseversion import LooseVersion
+from bcg.gateway import Gateway
+from bcg.framing import LineFramer
+from bcg.metrics import metrics_server_start
+
+
+class MqttLoopAdapter:
+    """Drive a paho client from an asyncio event loop instead of loop_start() thread"""
+
+    def __init__(self, loop, client, reconnect_delay=3):
+        self._loop = loop
+        self._client = client
+        self._reconnect_delay = reconnect_delay
+        self._thread_id = None
+        self._tasks = []
+
+        client.on_socket_open = self._on_socket_open
+        client.on_socket_close = self._on_socket_close
+        client.on_socket_register_write = self._on_socket_register_write
+        client.on_socket_unregister_write = self._on_socket_unregister_write
+
+    def start(self):
+        self._thread_id = threading.get_ident()
+        self._tasks.append(self._loop.create_task(self._connect_loop()))
+        self._tasks.append(self._loop.create_task(self._misc_loop()))
+
+    def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        self._client.disconnect()
+
+    def _call(self, callback, *args):
+        # paho calls the socket callbacks from the executor thread while connecting
+        if threading.get_ident() == self._thread_id:
+            callback(*args)
+        else:
+            self._loop.call_soon_threadsafe(callback, *args)
+
+    def _on_socket_open(self, client, userdata, sock):
+        self._call(self._loop.add_reader, sock, client.loop_read)
+
+    def _on_socket_close(self, client, userdata, sock):
+        self._call(self._loop.remove_reader, sock)
+        self._call(self._loop.remove_writer, sock)
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        self._call(self._loop.add_writer, sock, client.loop_write)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self._call(self._loop.remove_writer, sock)
+
+    async def _connect_loop(self):
+        while True:
+            if self._client.socket() is None:
+                try:
+                    await self._loop.run_in_executor(None, self._client.reconnect)
+                except Exception as e:
+                    logging.debug('MQTT connect: %s', e)
+            await asyncio.sleep(self._reconnect_delay)
+
+    async def _misc_loop(self):
+        while True:
+            self._client.loop_misc()
+            await asyncio.sleep(1)
+
+
+# the on_socket_* callbacks MqttLoopAdapter drives the client with
+PAHO_MIN_VERSION = '1.5.1'
+
+
+def run(mqttc, config, gateways, reconect):
+    """Run the gateways and the shared MQTT client on a new event loop until all serial ports are closed"""
+    if LooseVersion(paho.mqtt.__version__) < LooseVersion(PAHO_MIN_VERSION):
+        raise Exception('The asyncio engine needs paho-mqtt >= %s, %s is installed' % (PAHO_MIN_VERSION, paho.mqtt.__version__))
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(_main(loop, mqttc, config, gateways, reconect))
+    finally:
+        loop.close()
+
+
+async def _main(loop, mqttc, config, gateways, reconect):
+    mqttc.connect_async(config['mqtt']['host'], int(config['mqtt']['port']), keepalive=10)
+    mqtt_adapter = MqttLoopAdapter(loop, mqttc)
+    mqtt_adapter.start()
+
+    for gateway in gateways:
+        gateway.attach(loop, reconect)
+
+    try:
+        await asyncio.gather(*(gateway.stopped for gateway in gateways))
+    finally:
+        mqtt_adapter.stop()
+
+
+class AsyncioGateway(Gateway):
+    """Gateway running the serial port and the MQTT client on one asyncio event loop.
+
+    All message handlers of Gateway are called from the loop thread, so no state
+    is shared between threads.
+    """
+
+    def __init__(self, config, mqttc=None):
+        super().__init__(config, mqttc)
+        self._loop = None
+        self._reconect = True
+        self.stopped = None
+        self._framer = LineFramer()
+        self._downlink_event = None
+        self._spool_replay_task = None
+
+    def start(self, reconect):
+        self._log_start()
+        metrics_server_start(self._config, [self])
+        run(self.mqttc, self._config, [self], reconect)
+
+    def attach(self, loop, reconect):
+        self._loop = loop
+        self._reconect = reconect
+        self.stopped = loop.create_future()
+        self._downlink_event = asyncio.Event()
+        self._downlink.on_put = self._downlink_event.set
+        self._loop.create_task(self._scheduler_run())
+        self._serial_connect()
+
+    async def _scheduler_run(self):
+        while True:
+            wait = self._scheduler.poll()
+            await asyncio.sleep(1 if wait is None else min(wait, 1))
+
+    def _downlink_start(self):
+        if self._downlink_writer is None:
+            self._downlink_writer = self._loop.create_task(self._downlink_run())
+
+    async def _downlink_run(self):
+        while True:
+            line, wait = self._downlink.pop(time.monotonic())
+            if line is not None:
+                self._downlink_write(line)
+                continue
+
+            self._downlink_event.clear()
+            try:
+                await asyncio.wait_for(self._downlink_event.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+    def _spool_replay_start(self):
+        if self._spool_replay_task is None or self._spool_replay_task.done():
+            self._spool_replay_task = self._loop.create_task(self._spool_replay_run(self._spool))
+
+    def _spool_replay_active(self):
+        return self._spool_replay_task is not None and not self._spool_replay_task.done()
+
+    async def _spool_replay_run(self, spool):
+        while True:
+            wait = self._spool_replay_step(spool)
+            if wait is None:
+                return
+            await asyncio.sleep(wait)
+
+    def _serial_connect(self):
+        try:
+            self._serial_open(0)
+        except serial.serialutil.SerialException as e:
+            if e.errno == 2 and self._ser_error_cnt == 0:
+                logging.error('Could not open port %s' % self._config['device'])
+                self._ser_error_cnt += 1
+            self._serial_retry()
+            return
+        except Exception as e:
+            logging.error(e)
+            if self.ser:
+                self.ser.close()
+                self.ser = None
+            self._serial_retry()
+            return
+
+        self._framer.clear()
+        self._loop.add_reader(self.ser.fileno(), self._serial_read)
+
+    def _serial_retry(self):
+        if self._reconect:
+            self._loop.call_later(3, self._serial_connect)
+        elif not self.stopped.done():
+            self.stopped.set_result(None)
+
+    def _serial_read(self):
+        try:
+            data = self.ser.read(self.ser.in_waiting or 1)
+        except serial.SerialException:
+            self._loop.remove_reader(self.ser.fileno())
+            self.ser.close()
+            self.ser = None
+            self._serial_disconnect()
+            self._serial_retry()
+            return
+
+        if self.capture is not None:
+            self.capture.write(data)
+        lines = self._framer.feed(data)
+        if lines:
+            self._lines_received(lines)
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+PAGE_SIZE = 8
+
+ADD = 'add'
+REMOVE = 'remove'
+
+
+class AliasSync:
+    """EEPROM alias list and alias writes of the gateway firmware.
+
+    Up to window list pages or add/remove operations are sent without waiting
+    for the replies. An operation which is not acknowledged within timeout
+    seconds is sent again, retries times at most. Operations for an address
+    which wait to be sent are replaced by the latest one, an address has one
+    operation in flight at most, so the acknowledgement is never ambiguous.
+    Acknowledgements nothing is waiting for are ignored. When the retries of
+    the last operation for an address run out, on_failed(address, alias) gets
+    the alias the EEPROM had before the unconfirmed operations. A list page
+    without a reply is requested again until it comes, the alias writes wait
+    for the list.
+
+    add() and remove() are called from the MQTT thread of the thread engine,
+    the rest from the serial thread, the state is guarded by a lock which the
+    callbacks may take again.
+    """
+
+    def __init__(self, write, on_list, on_done, on_failed, window=4, timeout=2.0, retries=3):
+        self._write = write
+        self._on_list = on_list
+        self._on_done = on_done
+        self._on_failed = on_failed
+        self._window = window
+        self._timeout = timeout
+        self._retries = retries
+
+        self._pending = OrderedDict()  # address: (action, name)
+        self._inflight = {}  # address: [action, name, deadline, tries]
+        self._confirmed = {}  # address: alias, before the operations pending or in flight
+        self._lock = threading.RLock()
+
+        self._list = None
+        self._pages = {}  # page: [deadline, tries]
+        self._list_next = 0
+        self._list_end = None
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending) + len(self._inflight)
+
+    def clear(self):
+        with self._lock:
+            self._pending.clear()
+            self._inflight.clear()
+            self._confirmed.clear()
+            self._list = None
+            self._pages.clear()
+
+    # alias list
+
+    def list_start(self, now=None):
+        """Read the alias list, on_list(aliases) is called when all pages have been received"""
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            self._list = {}
+            self._pages.clear()
+            self._list_next = 0
+            self._list_end = None
+            self._list_fill(now)
+
+    def _list_fill(self, now):
+        while len(self._pages) < self._window and (self._list_end is None or self._list_next <= self._list_end):
+            self._list_request(self._list_next, now, 1)
+            self._list_next += 1
+
+    def _list_request(self, page, now, tries):
+        self._pages[page] = [now + self._timeout, tries]
+        self._write('$eeprom/alias/list', page)
+
+    def list_page(self, page, aliases, now=None):
+        if now is None:
+            now = time.monotonic()
+
+        with self._lock:
+            if self._list is None or self._pages.pop(page, None) is None:
+                logging.debug('Unexpected alias list page %s', page)
+                return
+
+            self._list.update(aliases)
+
+            if len(aliases) < PAGE_SIZE and (self._list_end is None or page < self._list_end):
+                self._list_end = page
+                for extra in [p for p in self._pages if p > page]:
+                    del self._pages[extra]
+
+            self._list_fill(now)
+
+            if self._list_end is not None and not self._pages:
+                self._list_done(now)
+
+    def _list_done(self, now):
+        aliases = self._list
+        self._list = None
+        self._on_list(aliases)
+        self._send(now)
+
+    # alias writes
+
+    def add(self, address, name, previous=None, now=None):
+        """Write the alias, previous is the alias the EEPROM has now"""
+        self._queue(address, ADD, name, previous, now)
+
+    def remove(self, address, previous=None, now=None):
+        self._queue(address, REMOVE, None, previous, now)
+
+    def _queue(self, address, action, name, previous, now):
+        with self._lock:
+            self._confirmed.setdefault(address, previous)
+            self._pending.pop(address, None)
+            self._pending[address] = (action, name)
+            self._send(time.monotonic() if now is None else now)
+
+    def _send(self, now):
+        if self._list is not None:
+            # wait for the list, the writes would interleave with its pages
+            return
+        for address in list(self._pending):
+            if len(self._inflight) >= self._window:
+                return
+            if address in self._inflight:
+                continue
+            action, name = self._pending.pop(address)
+            self._inflight[address] = [action, name, now + self._timeout, 1]
+            self._write_op(address, action, name)
+
+    def _write_op(self, address, action, name):
+        if action == ADD:
+            self._write('$eeprom/alias/add', {'id': address, 'name': name})
+        else:
+            self._write('$eeprom/alias/remove', address)
+
+    def ack(self, action, address, now=None):
+        with self._lock:
+            op = self._inflight.get(address)
+            if op is None or op[0] != action:
+                logging.debug('Unexpected alias %s ack for %s', action, address)
+                return
+            del self._inflight[address]
+            if address in self._pending:
+                self._confirmed[address] = op[1]
+            else:
+                self._confirmed.pop(address, None)
+            self._on_done(action, address)
+            self._send(time.monotonic() if now is None else now)
+
+    def poll(self, now=None):
+        """Resend the requests which timed out, give up the writes after the retries"""
+        if now is None:
+            now = time.monotonic()
+
+        with self._lock:
+            for page, (deadline, tries) in list(self._pages.items()):
+                if deadline > now:
+                    continue
+                if tries == self._retries + 1:
+                    logging.warning('No reply for alias list page %d, requesting it again', page)
+                self._list_request(page, now, tries + 1)
+
+            for address, op in list(self._inflight.items()):
+                if op[2] > now:
+                    continue
+                if op[3] > self._retries:
+                    logging.warning('No reply for alias %s of %s', op[0], address)
+                    del self._inflight[address]
+                    if address not in self._pending:
+                        # the next operation for the address decides, otherwise the EEPROM is as before
+                        self._on_failed(address, self._confirmed.pop(address, None))
+                else:
+                    op[2] = now + self._timeout
+                    op[3] += 1
+                    self._write_op(address, op[0], op[1])
+
+            self._send(now)
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import time
+from json.encoder import encode_basestring_ascii
+
+
+class Batcher:
+    """Collect node messages into one JSON array message.
+
+    Every entry is [alias, subtopic, value, timestamp], where alias is the node
+    alias or id, value the payload as published on the node topic and timestamp
+    the gateway time of the message in seconds since the epoch. The payloads
+    are encoded already, the entries are joined as strings without parsing them
+    again. The batch is published by flush(), or at once when it has size
+    entries.
+    """
+
+    def __init__(self, publish, size):
+        self._publish = publish
+        self._size = size
+        self._entries = []
+        self.published = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, alias, subtopic, payload, now=None):
+        """Add the encoded payload (str or bytes) of the node message"""
+        if isinstance(payload, bytes):
+            payload = payload.decode('utf-8', 'replace')
+        if now is None:
+            now = time.time()
+
+        self._entries.append('[%s, %s, %s, %.3f]' % (encode_basestring_ascii(alias), encode_basestring_ascii(subtopic), payload, now))
+
+        if len(self._entries) >= self._size:
+            self.flush()
+
+    def flush(self):
+        if not self._entries:
+            return
+        entries = self._entries
+        self._entries = []
+        self.published += len(entries)
+        self._publish('[' + ', '.join(entries) + ']')
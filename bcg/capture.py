@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import time
+import struct
+import logging
+import serial
+
+MAGIC = b'BCGCAP1\n'
+
+# microseconds since the previous chunk, chunk length
+_RECORD = struct.Struct('!IH')
+_DELTA_MAX = 0xffffffff
+_CHUNK_MAX = 0xffff
+
+
+class CaptureWriter:
+    """Append the chunks read from the serial port with their timing to a capture file.
+
+    Every chunk is stored as a 6 byte header (microseconds since the previous
+    chunk, length) followed by the raw bytes. A capture appended to an existing
+    file continues right after the previous one.
+    """
+
+    def __init__(self, path, flush_interval=1.0):
+        self.path = path
+        self._flush_interval = flush_interval
+        self._file = open(path, 'ab')
+        if self._file.tell() == 0:
+            self._file.write(MAGIC)
+        self._last = None
+        self._flushed = time.monotonic()
+        self.chunks = 0
+
+    def write(self, data):
+        now = time.monotonic()
+        delta = 0 if self._last is None else min(int((now - self._last) * 1e6), _DELTA_MAX)
+        self._last = now
+
+        for i in range(0, len(data), _CHUNK_MAX):
+            chunk = data[i:i + _CHUNK_MAX]
+            self._file.write(_RECORD.pack(delta, len(chunk)))
+            self._file.write(chunk)
+            delta = 0
+            self.chunks += 1
+
+        if now - self._flushed >= self._flush_interval:
+            self._flushed = now
+            self._file.flush()
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+
+def read_capture(path):
+    """Yield (seconds since the previous chunk, bytes) from a capture file"""
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('Not a capture file: %s' % path)
+        while True:
+            header = f.read(_RECORD.size)
+            if len(header) < _RECORD.size:
+                return
+            delta, length = _RECORD.unpack(header)
+            data = f.read(length)
+            if len(data) < length:
+                logging.warning('Truncated capture file: %s', path)
+                return
+            yield delta / 1e6, data
+
+
+class ReplaySerial:
+    """Stand-in for serial.Serial which reads a capture file.
+
+    The chunks are returned with the recorded timing divided by speed, speed 0
+    returns them as fast as the gateway reads. Reads return nothing until
+    ready() is true, so the replay can wait for the MQTT connection. Writes
+    are discarded. At the end of the capture read() raises SerialException,
+    as a disconnected device does.
+    """
+
+    def __init__(self, path, speed=1.0, timeout=None, ready=None, **kwargs):
+        self.port = path
+        self.timeout = timeout
+        self._speed = speed
+        self._ready = ready
+        self._chunks = read_capture(path)
+        self._data = b''
+        self._due = None
+        self.is_open = True
+        self.written = 0
+
+    def _next(self):
+        if self._due is not None:
+            return
+        try:
+            delta, self._data = next(self._chunks)
+        except StopIteration:
+            raise serial.SerialException('End of capture: %s' % self.port)
+        self._due = time.monotonic() + (delta / self._speed if self._speed else 0)
+
+    @property
+    def in_waiting(self):
+        if self._due is None or self._due > time.monotonic():
+            return 0
+        return len(self._data)
+
+    def read(self, size=1):
+        if not self.is_open:
+            raise serial.SerialException('Attempting to use a port that is not open')
+
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+
+        while self._ready is not None and not self._ready():
+            if deadline is not None and time.monotonic() >= deadline:
+                return b''
+            time.sleep(0.05)
+        self._ready = None
+
+        self._next()
+
+        wait = self._due - time.monotonic()
+        if deadline is not None:
+            wait = min(wait, deadline - time.monotonic())
+        if wait > 0:
+            time.sleep(wait)
+        if self._due > time.monotonic():
+            return b''
+
+        data = self._data[:size]
+        self._data = self._data[size:]
+        if not self._data:
+            self._due = None
+        return data
+
+    def write(self, data):
+        self.written += len(data)
+        return len(data)
+
+    def reset_input_buffer(self):
+        pass
+
+    def reset_output_buffer(self):
+        pass
+
+    def close(self):
+        self.is_open = False
+        self._chunks.close()
@@ -8,13 +8,71 @@ from io import IOBase
 from schema import Schema, And, Or, Use, Optional, SchemaError
 
 DEFAULT = {
+    'engine': 'thread',
     'mqtt': {
         'host': '127.0.0.1',
         'port': 1883,
+        'version': '3.1.1',
+        'topic_aliases': 64,
+        'session_expiry': 0,
+        'message_expiry': [],
     },
     'retain_node_messages': False,
     'qos_node_messages': 1,
+    'passthrough_node_messages': False,
+    'wildcard_subscription': False,
+    'warm_start': False,
+    'reload_interval': 2.0,
     'base_topic_prefix': '',  # ie. 'home-'
+    'alias_sync': {
+        'window': 4,
+        'timeout': 2.0,
+        'retries': 3,
+        'write_rename': True,
+    },
+    'aggregate': [],
+    'filter': [],
+    'log': {
+        'level': 'debug',
+        'rate': 0,
+        'burst': 20,
+        'collapse': False,
+        'batch_interval': 0,
+    },
+    'batch': {
+        'enabled': False,
+        'interval': 1.0,
+        'size': 100,
+        'passthrough': False,
+    },
+    'metrics': {
+        'interval': 0,
+        'http_host': '127.0.0.1',
+        'http_port': 0,
+    },
+    'spool': {
+        'enabled': False,
+        'memory_limit': 65536,
+        'sync_interval': 1.0,
+        'segment_size': 1048576,
+        'replay_rate': 100,
+        'compact': [],
+    },
+    'sink': {
+        'enabled': False,
+        'memory_limit': 65536,
+        'sync_interval': 5.0,
+        'segment_size': 4194304,
+        'segment_time': 3600,
+        'retention_time': 0,
+        'retention_size': 0,
+    },
+    'downlink': {
+        'queue_size': 256,
+        'line_rate': 0,
+        'byte_rate': 0,
+        'overflow': 'drop-oldest',
+    },
     'automatic_remove_kit_from_names': True,
     'automatic_rename_kit_nodes': True,
     'automatic_rename_generic_nodes': True,
@@ -27,9 +85,24 @@ def port_range(port):
     return 0 <= port <= 65535
 
 
+# options that can be set for each device in the devices list
+device_options = {
+    Optional('name'): And(str, len),
+    Optional('retain_node_messages'): Use(bool),
+    Optional('qos_node_messages'): And(int, lambda qos: 0 <= qos <= 2),
+    Optional('passthrough_node_messages'): Use(bool),
+    Optional('warm_start'): Use(bool),
+    Optional('automatic_remove_kit_from_names'): Use(bool),
+    Optional('automatic_rename_kit_nodes'): Use(bool),
+    Optional('automatic_rename_generic_nodes'): Use(bool),
+    Optional('automatic_rename_nodes'): Use(bool),
+    Optional('rename'): {Optional(Use(str)): Use(str)}
+}
+
 schema = Schema({
     Optional('device'): And(str, len),
-    Optional('name'): And(str, len),
+    Optional('devices'): [{'device': And(str, len), **device_options}],
+    Optional('engine'): Or('thread', 'asyncio'),
     Optional('mqtt'): {
         Optional('host'): And(str, len),
         Optional('port'): And(int, port_range),
@@ -38,15 +111,80 @@ schema = Schema({
         Optional('cafile'): And(str, len, os.path.exists),
         Optional('certfile'): And(str, len, os.path.exists),
         Optional('keyfile'): And(str, len, os.path.exists),
+        Optional('client_id'): And(str, len),
+        Optional('version'): And(Use(str), Or('3.1.1', '5')),
+        Optional('topic_aliases'): And(int, lambda aliases: 0 <= aliases <= 65535),
+        Optional('session_expiry'): And(int, lambda expiry: 0 <= expiry <= 0xffffffff),
+        Optional('message_expiry'): [{
+            'topic': And(str, len),
+            'expiry': And(int, lambda expiry: 0 < expiry <= 0xffffffff),
+        }],
     },
-    Optional('retain_node_messages'): Use(bool),
-    Optional('qos_node_messages'): And(int, lambda qos: 0 <= qos <= 2),
     Optional('base_topic_prefix'): str,  # ie. 'home-'
-    Optional('automatic_remove_kit_from_names'): Use(bool),
-    Optional('automatic_rename_kit_nodes'): Use(bool),
-    Optional('automatic_rename_generic_nodes'): Use(bool),
-    Optional('automatic_rename_nodes'): Use(bool),
-    Optional('rename'): {}
+    Optional('wildcard_subscription'): Use(bool),
+    Optional('reload_interval'): And(Or(int, float), lambda interval: interval >= 0),
+    Optional('alias_sync'): {
+        Optional('window'): And(int, lambda window: window > 0),
+        Optional('timeout'): And(Or(int, float), lambda timeout: timeout > 0),
+        Optional('retries'): And(int, lambda retries: retries >= 0),
+        Optional('write_rename'): Use(bool),
+    },
+    Optional('aggregate'): [{
+        'topic': And(str, len),
+        'window': And(Or(int, float), lambda window: window > 0),
+        Optional('suffix'): And(str, len),
+        Optional('passthrough'): Use(bool),
+    }],
+    Optional('filter'): [{
+        'topic': And(str, len),
+        Optional('change_only'): Use(bool),
+        Optional('deadband'): And(Or(int, float), lambda deadband: deadband >= 0),
+        Optional('deadband_percent'): And(Or(int, float), lambda deadband: deadband >= 0),
+        Optional('min_interval'): And(Or(int, float), lambda interval: interval >= 0),
+        Optional('heartbeat'): And(Or(int, float), lambda interval: interval >= 0),
+    }],
+    Optional('log'): {
+        Optional('level'): Or('debug', 'info', 'warning', 'error'),
+        Optional('rate'): And(Or(int, float), lambda rate: rate >= 0),
+        Optional('burst'): And(int, lambda burst: burst > 0),
+        Optional('collapse'): Use(bool),
+        Optional('batch_interval'): And(Or(int, float), lambda interval: interval >= 0),
+    },
+    Optional('batch'): {
+        Optional('enabled'): Use(bool),
+        Optional('interval'): And(Or(int, float), lambda interval: interval > 0),
+        Optional('size'): And(int, lambda size: size > 0),
+        Optional('passthrough'): Use(bool),
+    },
+    Optional('metrics'): {
+        Optional('interval'): And(Or(int, float), lambda interval: interval >= 0),
+        Optional('http_host'): And(str, len),
+        Optional('http_port'): And(int, port_range),
+    },
+    Optional('spool'): {
+        Optional('enabled'): Use(bool),
+        Optional('memory_limit'): And(int, lambda size: size >= 0),
+        Optional('sync_interval'): And(Or(int, float), lambda interval: interval >= 0),
+        Optional('segment_size'): And(int, lambda size: size > 0),
+        Optional('replay_rate'): And(Or(int, float), lambda rate: rate >= 0),
+        Optional('compact'): [And(str, len)],
+    },
+    Optional('sink'): {
+        Optional('enabled'): Use(bool),
+        Optional('memory_limit'): And(int, lambda size: size >= 0),
+        Optional('sync_interval'): And(Or(int, float), lambda interval: interval >= 0),
+        Optional('segment_size'): And(int, lambda size: size > 0),
+        Optional('segment_time'): And(Or(int, float), lambda interval: interval > 0),
+        Optional('retention_time'): And(Or(int, float), lambda interval: interval >= 0),
+        Optional('retention_size'): And(int, lambda size: size >= 0),
+    },
+    Optional('downlink'): {
+        Optional('queue_size'): And(int, lambda size: size > 0),
+        Optional('line_rate'): And(Or(int, float), lambda rate: rate >= 0),
+        Optional('byte_rate'): And(Or(int, float), lambda rate: rate >= 0),
+        Optional('overflow'): Or('drop-oldest', 'drop-newest'),
+    },
+    **device_options
 })
 
 
@@ -57,6 +195,7 @@ def load_config(config_file):
             config = schema.validate(config)
         except SchemaError as e:
             raise Exception('Load Config: ' + str(e))
+        _check_device_names(config)
 
     elif config_file is None:
         config = {}
@@ -66,6 +205,31 @@ def load_config(config_file):
     return config
 
 
+def _check_device_names(config):
+    # every device needs its own name for its data directory and MQTT topics,
+    # a name with {id} differs by the id of the connected gateway
+    names = set()
+    for device in config.get('devices', []):
+        name = device.get('name', config.get('name'))
+        if not name:
+            raise Exception('Load Config: device %s has no name' % device['device'])
+        if '{id}' in name:
+            continue
+        if name in names:
+            raise Exception('Load Config: name %s is used by more devices' % name)
+        names.add(name)
+
+
+def device_configs(config):
+    """Return the configuration of each device, the devices items override the top level options"""
+    devices = []
+    for device in config.get('devices', []):
+        device_config = {k: v for k, v in config.items() if k != 'devices'}
+        device_config.update(device)
+        devices.append(device_config)
+    return devices
+
+
 def _apply_default(config, default):
     for key in default:
         if key not in config:
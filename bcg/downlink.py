@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import time
+import threading
+import itertools
+from collections import deque, OrderedDict
+
+OVERFLOW_DROP_OLDEST = 'drop-oldest'
+OVERFLOW_DROP_NEWEST = 'drop-newest'
+
+
+def is_control(topic):
+    return topic[0] == '$' or topic.startswith('/info')
+
+
+class DownlinkQueue:
+    """Bounded queue of serial lines between MQTT and the serial port.
+
+    Control lines ($eeprom, /info) are sent first. A line for a node topic
+    replaces a line for the same topic that is still waiting, so only the latest
+    value is written. Lines leave the queue at line_rate lines per second and
+    byte_rate bytes per second at most, 0 means unlimited.
+    """
+
+    def __init__(self, size=256, line_rate=0, byte_rate=0, overflow=OVERFLOW_DROP_OLDEST, on_put=None):
+        self._size = size
+        self._line_interval = 1.0 / line_rate if line_rate else 0
+        self._byte_interval = 1.0 / byte_rate if byte_rate else 0
+        self._overflow = overflow
+        self.on_put = on_put
+
+        self._control = deque()
+        self._data = OrderedDict()
+        self._seq = itertools.count()
+        self._next = 0
+        self._cond = threading.Condition()
+
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self._control) + len(self._data)
+
+    def put(self, topic, line):
+        with self._cond:
+            if is_control(topic):
+                if not self._make_room():
+                    return False
+                self._control.append(line)
+
+            else:
+                coalesce = topic[0] != '/'
+                if coalesce and topic in self._data:
+                    self._data[topic] = line
+                    self.coalesced += 1
+                    return True
+
+                if not self._make_room():
+                    return False
+                self._data[topic if coalesce else next(self._seq)] = line
+
+            self._cond.notify()
+
+        if self.on_put:
+            self.on_put()
+
+        return True
+
+    def _make_room(self):
+        if len(self) < self._size:
+            return True
+
+        self.dropped += 1
+
+        if self._overflow == OVERFLOW_DROP_NEWEST:
+            return False
+
+        if self._data:
+            self._data.popitem(last=False)
+        else:
+            self._control.popleft()
+
+        return True
+
+    def pop(self, now=None):
+        """Return (line, None) if a line can be written now, else (None, seconds to wait) or (None, None) if empty"""
+        with self._cond:
+            return self._pop(time.monotonic() if now is None else now)
+
+    def _pop(self, now):
+        if self._control:
+            line = self._control[0]
+        elif self._data:
+            line = next(iter(self._data.values()))
+        else:
+            return None, None
+
+        if now < self._next:
+            return None, self._next - now
+
+        if self._control:
+            self._control.popleft()
+        else:
+            self._data.popitem(last=False)
+
+        self._next = now + max(self._line_interval, len(line) * self._byte_interval)
+        self.sent += 1
+
+        return line, None
+
+    def get(self):
+        """Block until a line can be written"""
+        with self._cond:
+            while True:
+                line, wait = self._pop(time.monotonic())
+                if line is not None:
+                    return line
+                self._cond.wait(wait)
+
+    def clear(self):
+        with self._cond:
+            self._control.clear()
+            self._data.clear()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import re
+import json
+import decimal
+from json.encoder import encode_basestring_ascii
+from collections.abc import Mapping, Iterable
+
+_Decimal = decimal.Decimal
+_INFINITY = float('inf')
+
+# numbers, literals and strings of printable ASCII without escapes
+_PLAIN_SCALAR = re.compile(rb'-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][+-]?[0-9]+)?|true|false|null|"[ !#-\[\]-~]*"')
+
+
+def _float_repr(o):
+    if o != o:
+        return 'NaN'
+    if o == _INFINITY:
+        return 'Infinity'
+    if o == -_INFINITY:
+        return '-Infinity'
+    return float.__repr__(o)
+
+
+def _decimal_repr(o):
+    s = str(o)
+    if 'E' in s or 'N' in s or 'n' in s:
+        # using normalize() gets rid of trailing 0s, using ':f' prevents scientific notation
+        return f'{o.normalize():f}'
+    if '.' in s:
+        # same result as normalize() for plain notation, without the context arithmetic
+        s = s.rstrip('0').rstrip('.')
+    return s
+
+
+def _key(k):
+    if isinstance(k, str):
+        return encode_basestring_ascii(k)
+    if k is True:
+        return '"true"'
+    if k is False:
+        return '"false"'
+    if k is None:
+        return '"null"'
+    if isinstance(k, _Decimal):
+        return '"' + _decimal_repr(k) + '"'
+    if isinstance(k, float):
+        return '"' + _float_repr(k) + '"'
+    if isinstance(k, int):
+        return '"' + int.__repr__(k) + '"'
+    raise TypeError(f'keys must be str, int, float, bool or None, not {k.__class__.__name__}')
+
+
+def _encode(o, append):
+    t = type(o)
+    if t is str:
+        append(encode_basestring_ascii(o))
+    elif t is _Decimal:
+        append(_decimal_repr(o))
+    elif o is None:
+        append('null')
+    elif o is True:
+        append('true')
+    elif o is False:
+        append('false')
+    elif t is int:
+        append(int.__repr__(o))
+    elif t is float:
+        append(_float_repr(o))
+    elif t is dict or isinstance(o, Mapping):
+        if not o:
+            append('{}')
+            return
+        first = True
+        for k, v in o.items():
+            if first:
+                append('{')
+                first = False
+            else:
+                append(', ')
+            append(_key(k))
+            append(': ')
+            _encode(v, append)
+        append('}')
+    elif t is list or t is tuple or (isinstance(o, Iterable) and not isinstance(o, (str, bytes, bytearray))):
+        first = True
+        for v in o:
+            if first:
+                append('[')
+                first = False
+            else:
+                append(', ')
+            _encode(v, append)
+        append('[]' if first else ']')
+    elif isinstance(o, str):
+        append(encode_basestring_ascii(o))
+    elif isinstance(o, _Decimal):
+        append(_decimal_repr(o))
+    elif isinstance(o, int):
+        append(int.__repr__(o))
+    elif isinstance(o, float):
+        append(_float_repr(o))
+    else:
+        raise TypeError(f'Object of type {o.__class__.__name__} is not JSON serializable')
+
+
+def json_encode(obj):
+    """Serialize obj to a JSON string in a single walk, with native Decimal support.
+
+    The output is the same as json.dumps with the default separators, except
+    that Decimal values are written as plain numbers without trailing zeros.
+    """
+    t = type(obj)
+    # scalar payloads are the common case for node messages
+    if t is _Decimal:
+        return _decimal_repr(obj)
+    if t is str:
+        return encode_basestring_ascii(obj)
+    if t is int:
+        return int.__repr__(obj)
+
+    parts = []
+    _encode(obj, parts.append)
+    return ''.join(parts)
+
+
+def json_line_valid(data):
+    """Return True if bytes data is one JSON value which can be written to a serial line as is.
+
+    Plain scalars are recognized without parsing, anything else is parsed once.
+    Values with line breaks or non-ASCII bytes are rejected, json_encode escapes
+    those.
+    """
+    if _PLAIN_SCALAR.fullmatch(data):
+        return True
+    if not data.isascii() or b'\n' in data or b'\r' in data:
+        return False
+    try:
+        json.loads(data)
+    except ValueError:
+        return False
+    return True
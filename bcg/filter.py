@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import time
+from decimal import Decimal, InvalidOperation
+from bcg.topic import TopicMatcher
+
+STATE_SIZE = 65536
+
+
+class _Rule:
+    __slots__ = ('change_only', 'deadband', 'deadband_percent', 'min_interval', 'heartbeat', 'numeric')
+
+    def __init__(self, rule):
+        self.change_only = rule.get('change_only', True)
+        self.deadband = Decimal(str(rule.get('deadband', 0)))
+        self.deadband_percent = Decimal(str(rule.get('deadband_percent', 0)))
+        self.min_interval = rule.get('min_interval', 0)
+        self.heartbeat = rule.get('heartbeat', 0)
+        self.numeric = bool(self.deadband or self.deadband_percent)
+
+
+def _number(payload):
+    if isinstance(payload, bytes):
+        payload = payload.decode('ascii', 'replace')
+    try:
+        value = Decimal(payload)
+    except InvalidOperation:
+        return None
+    return value if value.is_finite() else None
+
+
+class PublishFilter:
+    """Drop node messages which do not bring anything new, per topic pattern.
+
+    For every topic matching a rule the last published value and its time are
+    kept. A message is dropped when it comes sooner than min_interval after the
+    last one, or when it is unchanged (change_only) or numerically within the
+    deadband of the last published value, unless heartbeat seconds have passed.
+    flush() calls publish(topic, payload) with the latest value of the topics
+    with a heartbeat which were not published for heartbeat seconds.
+    """
+
+    def __init__(self, rules, prefix='', publish=None):
+        rules = [(prefix + rule['topic'], _Rule(rule)) for rule in rules]
+        self._matcher = TopicMatcher(rules)
+        self._publish = publish
+        self._state = {}
+        # topic -> (rule, latest payload) of the topics with a heartbeat
+        self._latest = {}
+        self.dropped = 0
+
+        heartbeats = [rule.heartbeat for _, rule in rules if rule.heartbeat]
+        self.interval = min([1.0] + [heartbeat / 2 for heartbeat in heartbeats]) if heartbeats and publish else 0
+
+    def __bool__(self):
+        return bool(self._matcher)
+
+    def allow(self, topic, payload, now=None):
+        """Return True if the encoded payload should be published to topic"""
+        rule = self._matcher.match(topic)
+        if rule is None:
+            return True
+
+        if now is None:
+            now = time.monotonic()
+
+        value = _number(payload) if rule.numeric else None
+        last = self._state.get(topic)
+
+        if rule.heartbeat:
+            if len(self._latest) >= STATE_SIZE and topic not in self._latest:
+                self._latest.clear()
+            self._latest[topic] = (rule, payload)
+
+        if last is not None:
+            elapsed = now - last[0]
+
+            if elapsed < rule.min_interval or ((not rule.heartbeat or elapsed < rule.heartbeat) and not self._changed(rule, last[1], payload, value)):
+                self.dropped += 1
+                return False
+
+        if len(self._state) >= STATE_SIZE and last is None:
+            self._state.clear()
+        self._state[topic] = (now, payload if value is None else value)
+
+        return True
+
+    def flush(self, now=None):
+        """Publish the latest value of the topics without a message published for their heartbeat"""
+        if now is None:
+            now = time.monotonic()
+        for topic, (rule, payload) in list(self._latest.items()):
+            last = self._state.get(topic)
+            if last is None or now - last[0] < rule.heartbeat:
+                continue
+            value = _number(payload) if rule.numeric else None
+            self._state[topic] = (now, payload if value is None else value)
+            self._publish(topic, payload)
+
+    @staticmethod
+    def _changed(rule, last, payload, value):
+        if value is None or not isinstance(last, Decimal):
+            return not rule.change_only or last != payload
+
+        delta = abs(value - last)
+        if delta < rule.deadband or delta * 100 < abs(last) * rule.deadband_percent:
+            return False
+        return not rule.change_only or delta != 0
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import logging
+
+
+class LineFramer:
+    """Split chunks of the serial byte stream into lines.
+
+    Every chunk is appended to one reusable buffer, all complete lines are cut
+    out at once and NUL bytes and carriage returns are removed from them in bulk.
+    """
+
+    def __init__(self, max_line=65536):
+        self._buffer = bytearray()
+        self._max_line = max_line
+
+    def feed(self, data):
+        """Return the list of complete non-empty lines, without line endings"""
+        buffer = self._buffer
+        buffer += data
+
+        end = buffer.rfind(b'\n')
+        if end < 0:
+            if len(buffer) > self._max_line:
+                logging.warning('Serial line too long, dropped %d bytes', len(buffer))
+                buffer.clear()
+            return []
+
+        chunk = bytes(buffer[:end])
+        del buffer[:end + 1]
+
+        if b'\x00' in chunk or b'\r' in chunk:
+            chunk = chunk.translate(None, b'\x00\r')
+
+        return [line for line in chunk.split(b'\n') if line]
+
+    def clear(self):
+        self._buffer.clear()
@@ -1,146 +1,417 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 import os
+import re
+import sys
+import math
 import time
 import logging
 import json
 import platform
 import socket
 import decimal
-import yaml
+import threading
 import serial
 import paho.mqtt.client
 import appdirs
-from collections.abc import Mapping, Iterable
+from json.encoder import encode_basestring_ascii
+from bcg.encoder import json_encode, json_line_valid
+from bcg.downlink import DownlinkQueue
+from bcg.spool import Spool
+from bcg.sink import Sink
+from bcg.store import JSONStore
+from bcg.framing import LineFramer
+from bcg.scheduler import Scheduler
+from bcg.filter import PublishFilter
+from bcg.aggregate import Aggregator
+from bcg.batch import Batcher
+from bcg.logfwd import LogForwarder
+from bcg.alias import AliasSync
+from bcg.nodes import NodeRegistry
+from bcg.mqtt5 import MqttV5Client
+from bcg.metrics import Registry, metrics_server_start
 
 if platform.system() == 'Linux':
     import fcntl
 
+TOPIC_CACHE_SIZE = 65536
 
-# https://stackoverflow.com/a/60243503/1076564
-class DecimalJSONEncoder(json.JSONEncoder):
-    """Add support for encoding Decimal"""
-    def encode(self, obj):
-        if isinstance(obj, Mapping):
-            return '{' + ', '.join(f'{self.encode(k)}: {self.encode(v)}' for (k, v) in obj.items()) + '}'
-        if isinstance(obj, Iterable) and (not isinstance(obj, str)):
-            return '[' + ', '.join(map(self.encode, obj)) + ']'
-        if isinstance(obj, decimal.Decimal):
-            # using normalize() gets rid of trailing 0s, using ':f' prevents scientific notation
-            return f'{obj.normalize():f}'
-        return super().encode(obj)
+# subscription for the messages to all nodes with wildcard_subscription
+NODE_WILDCARD = 'node/+/+/+/+/+'
+
+# options Gateway.config_reload applies, the others need a restart
+RELOAD_OPTIONS = ('name', 'rename', 'base_topic_prefix', 'wildcard_subscription',
+                  'retain_node_messages', 'qos_node_messages', 'passthrough_node_messages',
+                  'automatic_remove_kit_from_names', 'automatic_rename_kit_nodes',
+                  'automatic_rename_generic_nodes', 'automatic_rename_nodes',
+                  'aggregate', 'filter', 'batch', 'log')
+
+# options changing the aggregate, filter, batch or log stages
+PIPELINE_OPTIONS = ('base_topic_prefix', 'aggregate', 'filter', 'batch', 'log')
+
+
+def mqtt_client_create(config):
+    if config['mqtt']['version'] == '5':
+        mqttc = MqttV5Client(config)
+    else:
+        mqttc = paho.mqtt.client.Client(config['mqtt'].get('client_id', ''))
+    mqttc.username_pw_set(config['mqtt'].get('username'), config['mqtt'].get('password'))
+    if config['mqtt'].get('cafile'):
+        mqttc.tls_set(config['mqtt'].get('cafile'), config['mqtt'].get('certfile'), config['mqtt'].get('keyfile'))
+    return mqttc
+
+
+def mqtt_callbacks_add(mqttc, prefix, target):
+    mqttc.message_callback_add(prefix + "gateway/ping", target.gateway_ping)
+    mqttc.message_callback_add(prefix + "gateway/all/info/get", target.gateway_all_info_get)
+
+
+def mqtt_callbacks_remove(mqttc, prefix):
+    mqttc.message_callback_remove(prefix + "gateway/ping")
+    mqttc.message_callback_remove(prefix + "gateway/all/info/get")
+
+
+def mqtt_log_connect(rc):
+    logging.info('Connected to MQTT broker with code %s', rc)
+
+    lut = {paho.mqtt.client.CONNACK_REFUSED_PROTOCOL_VERSION: 'incorrect protocol version',
+           paho.mqtt.client.CONNACK_REFUSED_IDENTIFIER_REJECTED: 'invalid client identifier',
+           paho.mqtt.client.CONNACK_REFUSED_SERVER_UNAVAILABLE: 'server unavailable',
+           paho.mqtt.client.CONNACK_REFUSED_BAD_USERNAME_PASSWORD: 'bad username or password',
+           paho.mqtt.client.CONNACK_REFUSED_NOT_AUTHORIZED: 'not authorised'}
+
+    if rc != paho.mqtt.client.CONNACK_ACCEPTED:
+        # MQTT v5 reason codes have their own names
+        logging.error('Connection refused from reason: %s', lut.get(rc, 'unknown code') if isinstance(rc, int) else rc)
+        return False
+
+    return True
 
 
 class Gateway:
 
-    def __init__(self, config):
+    def __init__(self, config, mqttc=None):
         self._config = config
-        self._alias_list = {}
-        self._alias_action = {}
+        alias_sync = config['alias_sync']
+        self._alias_sync = AliasSync(self.write, self._alias_list_received, self._alias_done, self._alias_failed,
+                                     alias_sync['window'], alias_sync['timeout'], alias_sync['retries'])
+
+        self._nodes = NodeRegistry()
+        for address, name in config['rename'].items():
+            self._nodes.set_alias(address, name)
 
-        self._node_rename_id = config['rename'].copy()
-        self._node_rename_name = {v: k for k, v in config['rename'].items()}
         self._name = None
         self._data_dir = None
-        self._cache_nodes = {}
+        self._nodes_store = None
         self._info = None
         self._info_id = None
         self._sub = set(['gateway/ping', 'gateway/all/info/get'])
-        self._nodes = {}
+        # node ids and aliases with a node/<name>/+/+/+/+ subscription
+        self._sub_nodes = set()
+        self._sub_wildcard = config['wildcard_subscription']
+        # set by config_reload, which subscribes the differences at once
+        self._sub_deferred = False
 
         self._auto_rename_nodes = self._config['automatic_rename_nodes'] or self._config['automatic_rename_kit_nodes'] or self._config['automatic_rename_generic_nodes']
 
         self._ser_error_cnt = 0
         self.ser = None
-
-        self.mqttc = paho.mqtt.client.Client()
-        self.mqttc.on_connect = self.mqtt_on_connect
-        self.mqttc.on_message = self.mqtt_on_message
-        self.mqttc.on_disconnect = self.mqtt_on_disconnect
-        self.mqttc.message_callback_add(config['base_topic_prefix'] + "gateway/ping", self.gateway_ping)
-        self.mqttc.message_callback_add(config['base_topic_prefix'] + "gateway/all/info/get", self.gateway_all_info_get)
+        # replaced by bcg replay, capture is set by bcg record
+        self.serial_class = serial.Serial
+        self.capture = None
+
+        downlink = config['downlink']
+        self._downlink = DownlinkQueue(downlink['queue_size'], downlink['line_rate'], downlink['byte_rate'], downlink['overflow'])
+        self._downlink_writer = None
+
+        self._topic_cache = {}
+        self._topic_cache_nodes = {}
+        # the cache is filled by the serial thread and invalidated by renames on the MQTT thread too
+        self._topic_cache_lock = threading.Lock()
+
+        self._warm_store = None
+        self._warm_info_id = None
+        self._warm_nodes = None
+        self._warm_renames = None
+        if config['warm_start']:
+            directory = appdirs.user_data_dir('bcg')
+            os.makedirs(directory, exist_ok=True)
+            self._warm_store = JSONStore(os.path.join(directory, 'warm-%s.json' % re.sub(r'[^\w.-]', '_', config['device'])))
+
+        self._mqtt_connected = False
+        self._publish_info = None
+        self._spool = None
+        self._spool_replay = None
+        # mid -> (spool, segment) of the replayed messages until on_publish, acks arriving before the mid is known
+        self._spool_acks = {}
+        self._spool_acks_early = set()
+        self._spool_acks_lock = threading.Lock()
+        self._sink = None
+
+        self._scheduler = Scheduler()
+        self._pipeline_jobs = []
+        self._filter = None
+        self._batch = None
+        self._batch_published = 0
+        self._log = None
+        self._pipeline_setup()
+
+        self._metrics_init()
+        if config['metrics']['interval']:
+            self._scheduler.every(config['metrics']['interval'], self._metrics_publish)
+        self._scheduler.every(0.5, self._alias_sync.poll)
+        if config['spool']['enabled'] and config['spool']['sync_interval']:
+            self._scheduler.every(config['spool']['sync_interval'], self._spool_flush)
+        if config['sink']['enabled'] and config['sink']['sync_interval']:
+            self._scheduler.every(config['sink']['sync_interval'], self._sink_flush)
+
+        # the callbacks are dispatched by GatewayPool when the connection is shared
+        self._mqttc_own = mqttc is None
+        if mqttc is None:
+            self.mqttc = mqtt_client_create(config)
+            self.mqttc.on_connect = self.mqtt_on_connect
+            self.mqttc.on_message = self.mqtt_on_message
+            self.mqttc.on_disconnect = self.mqtt_on_disconnect
+            self.mqttc.on_publish = self.mqtt_on_publish
+            mqtt_callbacks_add(self.mqttc, config['base_topic_prefix'], self)
+        else:
+            self.mqttc = mqttc
 
         self._msg_retain = config['retain_node_messages']
         self._msg_qos = config['qos_node_messages']
-
-        self.mqttc.username_pw_set(config['mqtt'].get('username'), config['mqtt'].get('password'))
-        if config['mqtt'].get('cafile'):
-            self.mqttc.tls_set(config['mqtt'].get('cafile'), config['mqtt'].get('certfile'), config['mqtt'].get('keyfile'))
+        self._passthrough = config['passthrough_node_messages']
 
         self._rename()
 
+    def _pipeline_setup(self):
+        """Create the aggregate, filter, batch and log stages from the configuration"""
+        for job in self._pipeline_jobs:
+            self._scheduler.cancel(job)
+        self._pipeline_jobs = []
+
+        # the counters of the replaced stages are carried over, the metrics count since the start
+        old_filter, old_log = self._filter, self._log
+        if self._batch is not None:
+            self._batch_published += self._batch.published
+
+        config = self._config
+        self._filter = PublishFilter(config['filter'], config['base_topic_prefix'], self._filter_publish)
+        self._aggregator = Aggregator(config['aggregate'], self._aggregate_publish, config['base_topic_prefix'])
+        self._batch = Batcher(self._batch_publish, config['batch']['size']) if config['batch']['enabled'] else None
+        self._batch_passthrough = config['batch']['passthrough']
+        log = config['log']
+        self._log = LogForwarder(self._log_publish, log['level'], log['rate'], log['burst'], log['collapse'], bool(log['batch_interval']))
+
+        if old_filter is not None:
+            self._filter.dropped = old_filter.dropped
+        if old_log is not None:
+            self._log.dropped = old_log.dropped
+            self._log.collapsed = old_log.collapsed
+
+        if self._aggregator:
+            self._pipeline_jobs.append(self._scheduler.every(self._aggregator.interval, self._aggregator.flush))
+        if self._filter.interval:
+            self._pipeline_jobs.append(self._scheduler.every(self._filter.interval, self._filter.flush))
+        if self._batch is not None:
+            self._pipeline_jobs.append(self._scheduler.every(config['batch']['interval'], self._batch.flush))
+        if log['collapse'] or log['batch_interval']:
+            self._pipeline_jobs.append(self._scheduler.every(log['batch_interval'] or 1.0, self._log.flush))
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def connected(self):
+        """True while connected to the MQTT broker"""
+        return self._mqtt_connected
+
+    def _metrics_init(self):
+        self._started = time.monotonic()
+        self._rx_time = self._started
+
+        m = self.metrics = Registry()
+        m.gauge('uptime_seconds', 'Seconds since the gateway started', lambda: round(time.monotonic() - self._started, 3))
+        self._m_serial_opens = m.counter('serial_opens_total', 'Serial port opens')
+        self._m_serial_lines = m.counter('serial_lines_total', 'Lines read from the serial port')
+        self._m_serial_invalid = m.counter('serial_invalid_total', 'Invalid JSON messages read from the serial port')
+        m.labeled_gauge('node_messages_total', 'Messages received from nodes', 'node', self._nodes.message_counts, 'counter')
+        m.labeled_gauge('node_last_seen_seconds', 'Seconds since the last message from the node', 'node', lambda: self._nodes.last_seen(time.monotonic()))
+        self._m_log_messages = m.counter('log_messages_total', 'Firmware log lines')
+        m.gauge('log_dropped_total', 'Firmware log lines dropped by the rate limit', lambda: self._log.dropped, 'counter')
+        m.gauge('log_collapsed_total', 'Repeated firmware log lines forwarded as a count', lambda: self._log.collapsed, 'counter')
+        m.gauge('filter_dropped_total', 'Node messages dropped by the publish filter', lambda: self._filter.dropped, 'counter')
+        m.gauge('batch_entries_total', 'Node messages published in batches', lambda: self._batch_published + (self._batch.published if self._batch else 0), 'counter')
+        self._m_latency = m.histogram('publish_latency_seconds', 'Time from serial read to MQTT publish of node messages')
+        # a clock read and a bucket search per node message, only when the metrics are published
+        self._m_latency_on = bool(self._config['metrics']['interval'] or self._config['metrics']['http_port'])
+        self._m_publish = m.counter('mqtt_publish_total', 'Messages published to MQTT')
+        self._m_mqtt_connects = m.counter('mqtt_connects_total', 'Connections to the MQTT broker')
+        self._m_mqtt_disconnects = m.counter('mqtt_disconnects_total', 'Disconnections from the MQTT broker')
+        self._m_writes = m.counter('downlink_writes_total', 'Messages written to the serial port')
+        m.gauge('downlink_queue', 'Messages waiting in the downlink queue', lambda: len(self._downlink))
+        m.gauge('downlink_sent_total', 'Messages sent from the downlink queue', lambda: self._downlink.sent, 'counter')
+        m.gauge('downlink_dropped_total', 'Messages dropped from the full downlink queue', lambda: self._downlink.dropped, 'counter')
+        m.gauge('downlink_coalesced_total', 'Messages replaced by a newer one in the downlink queue', lambda: self._downlink.coalesced, 'counter')
+        m.gauge('spool_spooled_total', 'Messages spooled while the broker was not reachable', lambda: self._spool.spooled if self._spool else 0, 'counter')
+        m.gauge('spool_replayed_total', 'Spooled messages replayed', lambda: self._spool.replayed if self._spool else 0, 'counter')
+        m.gauge('sink_written_total', 'Node messages written to the local sink', lambda: self._sink.written if self._sink else 0, 'counter')
+
+    def _metrics_publish(self):
+        if self._name:
+            self.publish(["gateway", self._name, "stats"], self.metrics.snapshot())
+
     def _serial_disconnect(self):
         logging.info('Disconnect serial port')
 
+        self._warm_info_id = None
+        self._warm_nodes = None
+        self._warm_renames = None
+
         self._info_id = None
         self._info = None
         self._rename()
-        self._alias_list = {}
-        self._alias_action = {}
+        self._nodes.eeprom_clear()
+        self._alias_sync.clear()
+        self._downlink.clear()
+        self._topic_cache_clear()
 
-        for address in self._nodes.keys():
+        for address in self._nodes.attached():
             self.node_remove(address)
         self.gateway_all_info_get()
 
-    def _run(self):
-        self.ser = serial.Serial(self._config['device'], baudrate=115200, timeout=3.0)
+    def _serial_open(self, timeout):
+        self.ser = self.serial_class(self._config['device'], baudrate=115200, timeout=timeout)
 
         logging.info('Opened serial port: %s', self._config['device'])
 
+        self._m_serial_opens.inc()
+
         self._ser_error_cnt = 0
 
-        if platform.system() == 'Linux':
+        if platform.system() == 'Linux' and hasattr(self.ser, 'fileno'):
             fcntl.flock(self.ser.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
             logging.debug('Exclusive lock on file descriptor: %d' % self.ser.fileno())
 
         self.ser.reset_input_buffer()
         self.ser.reset_output_buffer()
         self.ser.write(b'\n')
+        self._downlink_start()
+        if self._warm_store is not None:
+            self._warm_restore()
         self.write("/info/get", None)
 
+    def _downlink_start(self):
+        if self._downlink_writer is None:
+            self._downlink_writer = threading.Thread(target=self._downlink_run, name='downlink', daemon=True)
+            self._downlink_writer.start()
+
+    def _downlink_run(self):
+        while True:
+            self._downlink_write(self._downlink.get())
+
+    def _downlink_write(self, line):
+        ser = self.ser
+        if not ser:
+            return
+        logging.debug("write %s", line)
+        try:
+            ser.write(line)
+        except Exception as e:
+            logging.warning('Serial write failed: %s', e)
+
+    def _run(self):
+        self._serial_open(1.0)
+
+        framer = LineFramer()
+
         while True:
             try:
-                line = self.ser.readline()
+                data = self.ser.read(self.ser.in_waiting or 1)
             except serial.SerialException:
                 self.ser.close()
+                self.ser = None
                 self._serial_disconnect()
                 raise
-            if line:
-                logging.debug("read %s", line)
+            if data:
+                if self.capture is not None:
+                    self.capture.write(data)
+                lines = framer.feed(data)
+                if lines:
+                    self._lines_received(lines)
 
-                if line[0] == 0:
-                    i = 1
-                    while line[i] == 0 and i < len(line):
-                        i += 1
-                    line = line[i:]
+            self._scheduler.poll()
 
-                line = line.decode()
+    def _lines_received(self, lines):
+        self._rx_time = time.monotonic()
+        self._m_serial_lines.inc(len(lines))
 
-                if line[0] == '#':
-                    self.log_message(line)
-                    continue
+        for line in lines:
+            try:
+                self._line_received(line)
+            except Exception as e:
+                logging.error('Failed to process message %s: %s', line, e)
+                if os.getenv('DEBUG', False):
+                    raise e
 
-                try:
-                    talk = json.loads(line, parse_float=decimal.Decimal)
-                    if len(talk) != 2:
-                        raise Exception
-                except Exception:
-                    logging.warning('Invalid JSON message received from serial port: %s', line)
-                    if self._info is None:
-                        self.write("/info/get", None)
-                    continue
+    def _line_received(self, line):
+        logging.debug("read %s", line)
 
-                subtopic = talk[0]
-                if subtopic[0] == "$":
-                    self.sys_message(subtopic, talk[1])
+        if line[0] == 35:  # '#'
+            self.log_message(line.decode('utf-8', 'replace'))
+            return
 
-                elif subtopic[0] == "/":
-                    self.gateway_message(subtopic, talk[1])
+        if self._passthrough and self._node_passthrough(line):
+            return
 
-                else:
-                    self.node_message(subtopic, talk[1])
+        try:
+            talk = json.loads(line, parse_float=decimal.Decimal)
+            if len(talk) != 2:
+                raise Exception
+        except Exception:
+            self._m_serial_invalid.inc()
+            logging.warning('Invalid JSON message received from serial port: %s', line.decode('utf-8', 'replace'))
+            if self._info is None:
+                self.write("/info/get", None)
+            return
 
-    def start(self, reconect):
+        subtopic = talk[0]
+        if subtopic[0] == "$":
+            self.sys_message(subtopic, talk[1])
+
+        elif subtopic[0] == "/":
+            self.gateway_message(subtopic, talk[1])
+
+        else:
+            self.node_message(subtopic, talk[1])
+
+    def _node_passthrough(self, line):
+        # ["<node id>/<topic>", <payload>] is published without decoding the payload,
+        # messages that the gateway inspects itself go through the full parser
+        if not line.startswith(b'["'):
+            return False
+
+        end = line.find(b'",', 2)
+        if end < 0:
+            return False
+
+        subtopic = line[2:end]
+        if subtopic[:1] in (b'$', b'/') or b'/' not in subtopic or b'\\' in subtopic or subtopic.endswith(b'/info'):
+            return False
+
+        payload = line[end + 2:].rstrip()
+        if not payload.endswith(b']'):
+            return False
+
+        payload = payload[:-1].strip()
+        if not json_line_valid(payload):
+            # e.g. ["id/x", 1, 2], the full parser reports it
+            return False
+
+        self.node_message_raw(subtopic.decode(), payload)
+        return True
+
+    def _log_start(self):
         logging.info('Start')
 
         logging.info('Serial port: %s', self._config['device'])
@@ -149,6 +420,11 @@ class Gateway:
                      int(self._config['mqtt']['port']),
                      bool(self._config['mqtt'].get('cafile')))
 
+    def start(self, reconect):
+        self._log_start()
+
+        metrics_server_start(self._config, [self])
+
         self.mqttc.connect_async(self._config['mqtt']['host'], int(self._config['mqtt']['port']), keepalive=10)
         self.mqttc.loop_start()
 
@@ -169,40 +445,89 @@ class Gateway:
                 break
 
             time.sleep(3)
+            self._scheduler.poll()
+
+    def mqtt_on_connect(self, client, userdata, flags, rc, properties=None):
+        if mqtt_log_connect(rc):
+            if isinstance(client, MqttV5Client):
+                client.session_start(properties)
+            self.mqtt_connected(client)
+
+    def mqtt_connected(self, client):
+        self._mqtt_connected = True
+        self._m_mqtt_connects.inc()
+        self.mqtt_subscribe(client)
+
+        if self._spool is not None and self._spool.active:
+            self._spool_replay_start()
+
+    def mqtt_disconnected(self):
+        self._mqtt_connected = False
+        self._m_mqtt_disconnects.inc()
+
+    def mqtt_subscribe(self, client):
+        topics = self._sub_topics()
+        logging.debug('subscribe %s', topics)
+        client.subscribe([(topic, 0) for topic in topics])
+
+    def _sub_topics(self):
+        """Return the MQTT subscriptions for the topics in _sub"""
+        prefix = self._config['base_topic_prefix']
+        if self._sub_wildcard:
+            topics = [topic for topic in self._sub if not topic.startswith('node/')]
+            topics.append(NODE_WILDCARD)
+        else:
+            topics = list(self._sub)
+        return [prefix + topic for topic in topics]
 
-    def mqtt_on_connect(self, client, userdata, flags, rc):
-        logging.info('Connected to MQTT broker with code %s', rc)
+    def mqtt_on_disconnect(self, client, userdata, rc, properties=None):
+        logging.info('Disconnect from MQTT broker with code %s', rc)
+        if isinstance(client, MqttV5Client):
+            client.session_end()
+        self.mqtt_disconnected()
 
-        lut = {paho.mqtt.client.CONNACK_REFUSED_PROTOCOL_VERSION: 'incorrect protocol version',
-               paho.mqtt.client.CONNACK_REFUSED_IDENTIFIER_REJECTED: 'invalid client identifier',
-               paho.mqtt.client.CONNACK_REFUSED_SERVER_UNAVAILABLE: 'server unavailable',
-               paho.mqtt.client.CONNACK_REFUSED_BAD_USERNAME_PASSWORD: 'bad username or password',
-               paho.mqtt.client.CONNACK_REFUSED_NOT_AUTHORIZED: 'not authorised'}
+    def mqtt_on_publish(self, client, userdata, mid):
+        with self._spool_acks_lock:
+            ack = self._spool_acks.pop(mid, None)
+            if ack is None and self._spool_replay_active():
+                self._spool_acks_early.add(mid)
+        if ack is not None:
+            ack[0].ack(ack[1])
 
-        if rc != paho.mqtt.client.CONNACK_ACCEPTED:
-            logging.error('Connection refused from reason: %s', lut.get(rc, 'unknown code'))
+    def mqtt_route(self, topic):
+        """Return True if the message on topic (without base_topic_prefix) is for this gateway"""
+        if topic.startswith('gateway/'):
+            return self._name is not None and topic.startswith('gateway/' + self._name + '/')
 
-        if rc == paho.mqtt.client.CONNACK_ACCEPTED:
-            for topic in self._sub:
-                logging.debug('subscribe %s', topic)
-                client.subscribe(self._config['base_topic_prefix'] + topic)
+        if topic.startswith('node/'):
+            return topic[5:topic.find('/', 5)] in self._sub_nodes
 
-    def mqtt_on_disconnect(self, client, userdata, rc):
-        logging.info('Disconnect from MQTT broker with code %s', rc)
+        return False
 
     def mqtt_on_message(self, client, userdata, message):
-        payload = message.payload.decode('utf-8')
         topic = message.topic[len(self._config['base_topic_prefix']):]
 
         logging.debug('mqtt_on_message %s %s', message.topic, message.payload)
 
+        if topic.startswith('node/'):
+            if self._sub_wildcard and topic[5:topic.find('/', 5)] not in self._sub_nodes:
+                return
+
+            # node commands go to the serial port as received, only validated
+            payload = message.payload.strip() or b'null'
+            if json_line_valid(payload):
+                self.write_raw(topic[5:], payload)
+                return
+
+        payload = message.payload.decode('utf-8')
+
         if payload == '':
             payload = 'null'
 
         try:
             payload = json.loads(payload)
         except Exception as e:
-            logging.error('parse json ' + str(message.topic) + ' ' + str(message.payload) + ' ' + str(e))
+            logging.error('parse json %s %s %s', message.topic, message.payload, e)
             return
 
         if topic.startswith("gateway"):
@@ -210,10 +535,12 @@ class Gateway:
             if subtopic == '/alias/set':
                 if "id" in payload and "alias" in payload:
                     self.node_rename(payload["id"], payload["alias"])
+                    self._warm_save()
                 return
             elif subtopic == '/alias/remove':
                 if payload:
                     self.node_rename(payload, None)
+                    self._warm_save()
                 return
         else:
             subtopic = topic[5:]
@@ -227,27 +554,66 @@ class Gateway:
         if isinstance(topic, list):
             topic = '/'.join(topic)
 
+        topic = self._downlink_topic(topic)
+        line = json_encode([topic, payload]) + '\n'
+        self._downlink_put(topic, line.encode('utf-8'))
+
+    def write_raw(self, topic, payload):
+        """Write payload bytes, which must be a valid JSON value without line breaks, as they are"""
+        if not self.ser:
+            return
+
+        topic = self._downlink_topic(topic)
+        line = b'[' + encode_basestring_ascii(topic).encode() + b', ' + payload + b']\n'
+        self._downlink_put(topic, line)
+
+    def _downlink_topic(self, topic):
         if topic[0] != '/' or topic[0] == '$':
             i = topic.find('/')
             node_name = topic[:i]
-            node_id = self._node_rename_name.get(node_name, None)
+            node_id = self._nodes.address(node_name)
             if node_id:
                 topic = node_id + topic[i:]
-        line = json.dumps([topic, payload], cls=DecimalJSONEncoder) + '\n'
-        line = line.encode('utf-8')
-        logging.debug("write %s", line)
-        self.ser.write(line)
+        return topic
+
+    def _downlink_put(self, topic, line):
+        self._m_writes.inc()
+        if not self._downlink.put(topic, line):
+            logging.debug('Downlink queue full, dropped %s', line)
 
     def publish(self, topic, payload):
         if isinstance(topic, list):
             topic = '/'.join(topic)
-        self.mqttc.publish(self._config['base_topic_prefix'] + topic, json.dumps(payload, cls=DecimalJSONEncoder), qos=1)
+        self._mqtt_publish(self._config['base_topic_prefix'] + topic, json_encode(payload), 1, False)
+
+    def _mqtt_publish(self, topic, payload, qos, retain):
+        self._m_publish.inc()
+        if self._spool is not None and self._spool.offer(topic, payload, qos, retain, self._mqtt_connected):
+            return
+        self._publish_info = self.mqttc.publish(topic, payload, qos=qos, retain=retain)
+
+    def mqtt_wait_published(self, timeout):
+        """Wait until the broker has acknowledged the last published message"""
+        info = self._publish_info
+        if info is not None and self._mqtt_connected:
+            try:
+                info.wait_for_publish(timeout)
+            except (ValueError, RuntimeError) as e:
+                logging.warning('Publish failed: %s', e)
 
     def log_message(self, line):
         logging.debug('log_message %s', line)
-        if self._name:
-            level_char = line[line.find("<") + 1]
-            self.publish(['log', self._name, log_level_lut[level_char]], line[1:].strip())
+        self._m_log_messages.inc()
+        self._log.add(line)
+
+    def _log_publish(self, level, payload):
+        if not self._name:
+            return
+        if level == 'batch':
+            # apart from log/<name>/<level>, which the subscribers of log/<name>/+ expect to hold one line
+            self.publish(['log-batch', self._name], payload)
+        else:
+            self.publish(['log', self._name, level], payload)
 
     def gateway_ping(self, *args):
         if self._name:
@@ -261,27 +627,46 @@ class Gateway:
         # logging.debug("on_sys_message %s %s", topic, payload)
         if topic.startswith("$eeprom/alias/list/"):
             topic, page = topic.rsplit('/', 1)
-            self._alias_list.update(payload)
-            if len(payload) == 8:
-                self.write("$eeprom/alias/list", int(page) + 1)
-            else:
-                logging.debug("alias_list: %s", self._alias_list)
-                for address, name in self._alias_list.items():
-                    self.node_rename(address, name)
-
-                self.write("/nodes/get", None)
-
-        if topic == "$eeprom/alias/add/ok":
-            if self._alias_action[payload] == 'add':
-                del self._alias_action[payload]
-                self.publish(["gateway", self._name, "alias/set/ok"], {'id': payload, 'alias': self._alias_list.get(payload, None)})
-            self._alias_action_next()
+            self._alias_sync.list_page(int(page), payload)
+
+        elif topic == "$eeprom/alias/add/ok":
+            self._alias_sync.ack('add', payload)
 
         elif topic == "$eeprom/alias/remove/ok":
-            if self._alias_action[payload] == 'remove':
-                del self._alias_action[payload]
-                self.publish(["gateway", self._name, "alias/remove/ok"], {'id': payload, 'alias': self._alias_list.get(payload, None)})
-            self._alias_action_next()
+            self._alias_sync.ack('remove', payload)
+
+    def _alias_list_received(self, aliases):
+        logging.debug("alias_list: %s", aliases)
+        # keep the aliases set while the list was read, their writes follow
+        for address, name in aliases.items():
+            if self._nodes.eeprom_alias(address) is None:
+                self._nodes.set_eeprom_alias(address, name)
+        aliases = self._nodes.eeprom_aliases()
+
+        rename = self._config['rename']
+        for address, name in list(aliases.items()):
+            if address not in rename:
+                self.node_rename(address, name)
+
+        if self._config['alias_sync']['write_rename']:
+            # only the differences of the configuration are written
+            for address, name in rename.items():
+                self._alias_add(address, name)
+
+        if self._warm_renames is not None:
+            self._warm_reconcile_renames(aliases)
+
+        self._warm_save()
+
+        self.write("/nodes/get", None)
+
+    def _alias_done(self, action, address):
+        topic = "alias/set/ok" if action == 'add' else "alias/remove/ok"
+        self.publish(["gateway", self._name, topic], {'id': address, 'alias': self._nodes.eeprom_alias(address)})
+
+    def _alias_failed(self, address, alias):
+        # the write is not confirmed, keep the alias the EEPROM had so a later rename writes it again
+        self._nodes.set_eeprom_alias(address, alias)
 
     def gateway_message(self, topic, payload):
         if "/info" == topic:
@@ -292,34 +677,29 @@ class Gateway:
             if payload['id'] == '000000000000':
                 self.write("/info/get", None)
                 return
+            if self._warm_info_id is not None and self._warm_info_id != payload['id']:
+                self._warm_discard()
             self._info_id = payload['id']
             self._info = payload
             self._rename()
 
             if self._info["firmware"].startswith("bcf-gateway-core-module") or self._info["firmware"].startswith("bcf-usb-gateway"):
-                self._node_rename_id[self._info_id] = self._name
-                self._node_rename_name[self._name] = self._info_id
+                self._nodes.set_alias(self._info_id, self._name)
+                self._topic_cache_invalidate(self._info_id)
                 self.node_add(self._info_id)
 
-            self.write("$eeprom/alias/list", 0)
+            self._alias_sync.list_start()
 
         elif "/nodes" == topic:
-            for i, node in enumerate(payload):
-                if not isinstance(node, dict):
-                    node = {"id": node}
+            payload = [node if isinstance(node, dict) else {"id": node} for node in payload]
 
+            for node in payload:
                 self.node_add(node["id"])
 
-                name = self._node_rename_id.get(node["id"], None)
-                if name:
-                    node["alias"] = name
+            self._nodes.describe(payload)
 
-                info = self._nodes[node["id"]].get('info')
-                if info:
-                    node['firmware'] = info.get('firmware')
-                    node['version'] = info.get('version')
-
-                payload[i] = node
+            if self._warm_nodes is not None:
+                self._warm_reconcile_nodes(set(node["id"] for node in payload))
 
         elif "/attach" == topic:
             self.node_add(payload)
@@ -330,31 +710,29 @@ class Gateway:
         if self._name:
             self.publish(["gateway", self._name, topic[1:]], payload)
 
-    def node_message(self, subtopic, payload):
+        self._warm_save()
 
-        node_ide, topic = subtopic.split('/', 1)
+    def node_message(self, subtopic, payload):
 
-        try:
-            node_name = self._node_rename_id.get(node_ide, None)
-            if node_name:
-                subtopic = node_name + '/' + topic
+        self._node_publish(subtopic, json_encode(payload))
 
-            self.mqttc.publish(self._config['base_topic_prefix'] + "node/" + subtopic, json.dumps(payload, cls=DecimalJSONEncoder), qos=self._msg_qos, retain=self._msg_retain)
+        if not subtopic.endswith('/info'):
+            return
 
-        except Exception:
-            raise
-            logging.error('Failed to publish MQTT message: %s, %s', subtopic, payload)
+        node_ide, topic = subtopic.split('/', 1)
 
-        logging.debug('topic %s', topic)
+        if topic == 'info' and isinstance(payload, dict) and 'firmware' in payload:
 
-        if topic == 'info' and 'firmware' in payload:
+            if not self._nodes.is_attached(node_ide):
+                logging.debug('info from unknown node %s', node_ide)
+                return
 
-            self._nodes[node_ide]['info'] = payload
+            self._nodes.set_info(node_ide, payload)
 
             self._save_nodes_json()
 
             if self._auto_rename_nodes:
-                if node_ide not in self._node_rename_id:
+                if self._nodes.alias(node_ide) is None:
                     name_base = None
 
                     if self._config['automatic_rename_generic_nodes'] and payload['firmware'].startswith("generic-node"):
@@ -368,135 +746,201 @@ class Gateway:
                     if name_base:
                         for i in range(0, 32):
                             name = name_base + ':' + str(i)
-                            if name not in self._node_rename_name:
+                            if self._nodes.address(name) is None:
                                 self.node_rename(node_ide, name)
                                 return
 
+    def node_message_raw(self, subtopic, payload):
+        self._node_publish(subtopic, payload)
+
+    def _node_publish(self, subtopic, payload):
+        i = subtopic.find('/')
+        self._nodes.seen(subtopic[:i], self._rx_time)
+        if self._sink is not None:
+            self._sink.add(subtopic[:i], self._nodes.alias(subtopic[:i]), subtopic[i + 1:], payload)
+        topic = self._node_topic(subtopic)
+        if self._aggregator and self._aggregator.add(topic, payload):
+            return
+        if self._filter and not self._filter.allow(topic, payload):
+            return
+        if self._batch is not None:
+            self._batch.add(self._nodes.alias(subtopic[:i]) or subtopic[:i], subtopic[i + 1:], payload)
+            if not self._batch_passthrough:
+                return
+        self._mqtt_publish(topic, payload, self._msg_qos, self._msg_retain)
+        if self._m_latency_on:
+            self._m_latency.observe(time.monotonic() - self._rx_time)
+
+    def _filter_publish(self, topic, payload):
+        # heartbeat of a filtered topic, goes out the way _node_publish sends the messages passing the filter
+        if self._batch is not None:
+            name, subtopic = topic[len(self._config['base_topic_prefix']) + len('node/'):].split('/', 1)
+            self._batch.add(name, subtopic, payload)
+            if not self._batch_passthrough:
+                return
+        self._mqtt_publish(topic, payload, self._msg_qos, self._msg_retain)
+
+    def _batch_publish(self, payload):
+        if self._name:
+            self._mqtt_publish(self._config['base_topic_prefix'] + 'gateway/' + self._name + '/batch', payload, self._msg_qos, False)
+        else:
+            logging.debug('No gateway name, batch dropped')
+
+    def _aggregate_publish(self, topic, suffix, summary):
+        # outside of node/..., a summary topic could match the node command subscriptions
+        # and come back from the broker as a command for the node
+        if not self._name:
+            logging.debug('No gateway name, aggregate dropped')
+            return
+        prefix = self._config['base_topic_prefix']
+        node_topic = topic[len(prefix) + len('node/'):]
+        self._mqtt_publish(prefix + 'gateway/' + self._name + '/' + suffix + '/' + node_topic, json_encode(summary), self._msg_qos, self._msg_retain)
+
+    def _node_topic(self, subtopic):
+        """Return the MQTT topic for the node subtopic "<id>/<topic>" with the node alias applied"""
+        try:
+            return self._topic_cache[subtopic]
+        except KeyError:
+            pass
+
+        node_ide, topic = subtopic.split('/', 1)
+
+        # a rename changes the alias before it invalidates the cache, so under the
+        # lock either the new alias is read or the stored topic is dropped after
+        with self._topic_cache_lock:
+            node_name = self._nodes.alias(node_ide)
+            mqtt_topic = sys.intern(self._config['base_topic_prefix'] + "node/" + (node_name or node_ide) + '/' + topic)
+
+            if len(self._topic_cache) >= TOPIC_CACHE_SIZE:
+                self._topic_cache = {}
+                self._topic_cache_nodes = {}
+            self._topic_cache[subtopic] = mqtt_topic
+            self._topic_cache_nodes.setdefault(node_ide, []).append(subtopic)
+
+        return mqtt_topic
+
+    def _topic_cache_invalidate(self, address):
+        with self._topic_cache_lock:
+            for subtopic in self._topic_cache_nodes.pop(address, ()):
+                self._topic_cache.pop(subtopic, None)
+
+    def _topic_cache_clear(self):
+        with self._topic_cache_lock:
+            self._topic_cache = {}
+            self._topic_cache_nodes = {}
+
     def sub_add(self, topic):
         if isinstance(topic, list):
             topic = '/'.join(topic)
         if topic not in self._sub:
+            self._sub.add(topic)
+            if topic.startswith('node/'):
+                self._sub_nodes.add(topic[5:topic.find('/', 5)])
+                if self._sub_wildcard:
+                    return
+            if self._sub_deferred:
+                return
             logging.debug('subscribe %s', topic)
-            self._sub.update([topic])
             self.mqttc.subscribe(self._config['base_topic_prefix'] + topic)
 
     def sub_remove(self, topic):
         if isinstance(topic, list):
             topic = '/'.join(topic)
         if topic in self._sub:
-            logging.debug('unsubscribe %s', topic)
             self._sub.remove(topic)
+            if topic.startswith('node/'):
+                self._sub_nodes.discard(topic[5:topic.find('/', 5)])
+                if self._sub_wildcard:
+                    return
+            if self._sub_deferred:
+                return
+            logging.debug('unsubscribe %s', topic)
             self.mqttc.unsubscribe(self._config['base_topic_prefix'] + topic)
 
     def node_add(self, address):
-        if address in self._nodes:
+        node = self._nodes.attach(address)
+        if node is None:
             return
         logging.debug('node_add %s', address)
-        self._nodes[address] = {}
-        if address in self._cache_nodes:
-            info = self._cache_nodes[address].get('info')
-            if info:
-                self._nodes[address]['info'] = info
 
         self.sub_add(['node', address, '+/+/+/+'])
-        name = self._node_rename_id.get(address, None)
-        if name:
-            self.sub_add(['node', name, '+/+/+/+'])
+        if node.alias:
+            self.sub_add(['node', node.alias, '+/+/+/+'])
 
     def node_remove(self, address):
         logging.debug('node_remove %s', address)
-        if address not in self._nodes:
+        node = self._nodes.detach(address)
+        if node is None:
             logging.debug('address not in self._nodes %s', address)
             return
-        del self._nodes[address]
         self.sub_remove(['node', address, '+/+/+/+'])
 
-        name = self._node_rename_id.get(address, None)
+        name = node.alias
         if name:
             self.sub_remove(['node', name, '+/+/+/+'])
 
-            if address in self._alias_list and self._alias_list[address] == name:
+            if node.eeprom_alias == name:
                 self._alias_remove(address)
 
             if address not in self._config['rename']:
-                self._node_rename_id.pop(address, None)
-                if self._node_rename_name[name] == address:
-                    self._node_rename_name.pop(name, None)
+                self._nodes.set_alias(address, None)
+
+        self._topic_cache_invalidate(address)
 
     def node_rename(self, address, name):
         logging.debug('node_rename %s to %s', address, name)
 
-        if name in self._node_rename_name:
+        if self._nodes.address(name) is not None:
             logging.debug('name is exists %s to %s', address, name)
             return False
 
-        old_name = self._node_rename_id.get(address, None)
+        old_name = self._nodes.alias(address)
 
         if old_name:
             self.sub_remove(['node', old_name, '+/+/+/+'])
-            del self._node_rename_name[old_name]
 
         if name:
-            self._node_rename_id[address] = name
-            self._node_rename_name[name] = address
+            self._nodes.set_alias(address, name)
 
-            if address in self._nodes:
+            if self._nodes.is_attached(address):
                 self.sub_add(['node', name, '+/+/+/+'])
 
-            if address not in self._alias_list or self._alias_list[address] != name:
-                self._alias_add(address, name)
+            self._alias_add(address, name)
 
         else:
 
             if old_name:
-                del self._node_rename_id[address]
+                self._nodes.set_alias(address, None)
 
             self.sub_add(['node', address, '+/+/+/+'])
 
             self._alias_remove(address)
 
+        # after the alias is changed, see _node_topic
+        self._topic_cache_invalidate(address)
+
         # if 'config_file' in self._config:
         #     with open(self._config['config_file'], 'r') as f:
         #         config_yaml = yaml.load(f)
-        #         config_yaml['rename'] = self._node_rename_id
+        #         config_yaml['rename'] = self._nodes.aliases()
         #     with open(self._config['config_file'], 'w') as f:
         #         yaml.safe_dump(config_yaml, f, indent=2, default_flow_style=False)
 
         return True
 
     def _alias_add(self, address, alias):
-        if address in self._alias_list and self._alias_list[address] == alias:
+        if self._nodes.eeprom_alias(address) == alias:
             return
 
-        self._alias_list[address] = alias
-
-        self._alias_action[address] = 'add'
-
-        if len(self._alias_action) == 1:
-            self.write('$eeprom/alias/add', {'id': address, 'name': alias})
+        previous = self._nodes.set_eeprom_alias(address, alias)
+        self._alias_sync.add(address, alias, previous)
 
     def _alias_remove(self, address):
-        if address not in self._alias_list:
+        previous = self._nodes.set_eeprom_alias(address, None)
+        if previous is None:
             return
 
-        del self._alias_list[address]
-
-        self._alias_action[address] = 'remove'
-
-        if len(self._alias_action) == 1:
-            self.write('$eeprom/alias/remove', address)
-
-    def _alias_action_next(self):
-        if not self._alias_action:
-            return
-        for address in self._alias_action:
-            action = self._alias_action[address]
-            if action == 'add':
-                name = self._alias_list[address]
-                self.write('$eeprom/alias/add', {'id': address, 'name': name})
-            else:
-                self.write('$eeprom/alias/remove', address)
-            return
+        self._alias_sync.remove(address, previous)
 
     def _rename(self):
         if self._name:
@@ -504,7 +948,7 @@ class Gateway:
 
         self._name = None
         self._data_dir = None
-        self._cache_nodes = {}
+        self._topic_cache_clear()
 
         name = self._config.get('name')
 
@@ -536,18 +980,274 @@ class Gateway:
 
             os.makedirs(self._data_dir, exist_ok=True)
 
-            try:
-                self._cache_nodes = json.load(open(os.path.join(self._data_dir, 'nodes.json')))
-            except Exception as e:
-                pass
+            path = os.path.join(self._data_dir, 'nodes.json')
+            if self._nodes_store is None or self._nodes_store.path != path:
+                if self._nodes_store is not None:
+                    self._nodes_store.flush()
+                self._nodes_store = JSONStore(path)
+
+            cache = self._nodes_store.load({})
+            if not isinstance(cache, dict):
+                logging.warning('Invalid nodes cache %s', path)
+                cache = {}
+            self._nodes.info_load(cache)
 
             self.sub_add(["gateway", self._name, '+/+'])
 
+        self._spool_open()
+        self._sink_open()
+
+    def watch_config(self, reloader):
+        self._scheduler.every(reloader.interval, reloader.poll)
+
+    def config_reload(self, config):
+        """Apply the reloadable options of the new configuration without reopening the serial port"""
+        restart = sorted(key for key in set(config) | set(self._config)
+                         if key not in RELOAD_OPTIONS and key != 'devices' and config.get(key) != self._config.get(key))
+        if restart:
+            logging.warning('Changed options need a restart: %s', ', '.join(restart))
+
+        changed = [key for key in RELOAD_OPTIONS if config.get(key) != self._config.get(key)]
+        if not changed:
+            return
+        logging.info('Reload options: %s', ', '.join(changed))
+
+        old = {key: self._config[key] for key in changed}
+        subscriptions = self._sub_topics()
+
+        if any(key in changed for key in PIPELINE_OPTIONS):
+            # the collected messages go out with the old settings
+            self._aggregator.flush(math.inf)
+            if self._batch is not None:
+                self._batch.flush()
+            self._log.flush()
+
+        self._sub_deferred = True
+        try:
+            for key in changed:
+                self._config[key] = config[key]
+
+            self._sub_wildcard = self._config['wildcard_subscription']
+            self._msg_retain = self._config['retain_node_messages']
+            self._msg_qos = self._config['qos_node_messages']
+            self._passthrough = self._config['passthrough_node_messages']
+            self._auto_rename_nodes = self._config['automatic_rename_nodes'] or self._config['automatic_rename_kit_nodes'] or self._config['automatic_rename_generic_nodes']
+
+            if 'base_topic_prefix' in changed:
+                self._topic_cache_clear()
+                if self._mqttc_own:
+                    mqtt_callbacks_remove(self.mqttc, old['base_topic_prefix'])
+                    mqtt_callbacks_add(self.mqttc, self._config['base_topic_prefix'], self)
+                    if isinstance(self.mqttc, MqttV5Client):
+                        self.mqttc.expiry_set(self._config['base_topic_prefix'], self._config['mqtt']['message_expiry'])
+                if self._spool is not None:
+                    self._spool.compact_set([self._config['base_topic_prefix'] + pattern for pattern in self._config['spool']['compact']])
+
+            if any(key in changed for key in PIPELINE_OPTIONS):
+                self._pipeline_setup()
+
+            if 'rename' in changed:
+                self._rename_reload(old['rename'], self._config['rename'])
+
+            if 'name' in changed:
+                self._rename()
+                self.gateway_all_info_get()
+        finally:
+            self._sub_deferred = False
+
+        self._sub_apply(subscriptions)
+        self._warm_save()
+
+    def _rename_reload(self, old, new):
+        for address, name in old.items():
+            if address not in new and self._nodes.alias(address) == name:
+                self.node_rename(address, None)
+
+        pending = [(address, name) for address, name in new.items() if self._nodes.alias(address) != name]
+        released = False
+        while pending:
+            failed = [(address, name) for address, name in pending if not self.node_rename(address, name)]
+            if len(failed) == len(pending):
+                if released:
+                    break
+                # the names are held by nodes which get a new name too, e.g. two nodes swap names
+                wanted = set(name for _, name in failed)
+                for address, _ in failed:
+                    if self._nodes.alias(address) in wanted:
+                        self.node_rename(address, None)
+                released = True
+            pending = failed
+
+        for address, name in pending:
+            logging.warning('Rename of %s to %s skipped, the name is used', address, name)
+
+    def _sub_apply(self, subscriptions):
+        """Subscribe and unsubscribe the differences of _sub_topics to the subscriptions before"""
+        current = self._sub_topics()
+        unsubscribe = sorted(set(subscriptions) - set(current))
+        subscribe = sorted(set(current) - set(subscriptions))
+
+        if unsubscribe:
+            logging.debug('unsubscribe %s', unsubscribe)
+            self.mqttc.unsubscribe(unsubscribe)
+        if subscribe:
+            logging.debug('subscribe %s', subscribe)
+            self.mqttc.subscribe([(topic, 0) for topic in subscribe])
+
+    def _spool_open(self):
+        spool = self._config['spool']
+        directory = os.path.join(self._data_dir, 'spool') if self._data_dir and spool['enabled'] else None
+
+        if self._spool is not None:
+            if self._spool.directory == directory:
+                return
+            self._spool.close()
+            self._spool = None
+
+        if directory:
+            self._spool = Spool(directory, spool['memory_limit'], spool['sync_interval'], spool['segment_size'],
+                                [self._config['base_topic_prefix'] + pattern for pattern in spool['compact']])
+
+            if self._spool.active and self._mqtt_connected:
+                self._spool_replay_start()
+
+    def _spool_flush(self):
+        if self._spool is not None:
+            self._spool.flush()
+
+    def _sink_open(self):
+        sink = self._config['sink']
+        directory = os.path.join(self._data_dir, 'sink') if self._data_dir and sink['enabled'] else None
+
+        if self._sink is not None:
+            if self._sink.directory == directory:
+                return
+            self._sink.close()
+            self._sink = None
+
+        if directory:
+            self._sink = Sink(directory, sink['memory_limit'], sink['sync_interval'], sink['segment_size'], sink['segment_time'],
+                              sink['retention_time'], sink['retention_size'])
+
+    def _sink_flush(self):
+        if self._sink is not None:
+            self._sink.flush()
+
+    def _spool_replay_start(self):
+        if not self._spool_replay_active():
+            self._spool_replay = threading.Thread(target=self._spool_replay_run, args=(self._spool,), name='spool', daemon=True)
+            self._spool_replay.start()
+
+    def _spool_replay_active(self):
+        return self._spool_replay is not None and self._spool_replay.is_alive()
+
+    def _spool_replay_run(self, spool):
+        while True:
+            wait = self._spool_replay_step(spool)
+            if wait is None:
+                return
+            time.sleep(wait)
+
+    def _spool_replay_step(self, spool):
+        """Publish a batch of spooled messages, return seconds to wait before the next batch or None when done"""
+        if not self._mqtt_connected:
+            return None
+
+        rate = self._config['spool']['replay_rate']
+        messages = spool.read(max(int(rate / 10), 1) if rate else 100)
+
+        if not messages:
+            logging.info('Spool replay finished')
+            return None
+
+        # on_publish may run before publish returns the mid, the spool deletes a segment when all its messages are acknowledged
+        published = []
+        for topic, payload, qos, retain, segment in messages:
+            published.append((self.mqttc.publish(topic, payload, qos=qos, retain=retain).mid, segment))
+
+        acked = []
+        with self._spool_acks_lock:
+            for mid, segment in published:
+                if mid in self._spool_acks_early:
+                    acked.append(segment)
+                else:
+                    self._spool_acks[mid] = (spool, segment)
+            self._spool_acks_early.clear()
+        for segment in acked:
+            spool.ack(segment)
+
+        return len(messages) / rate if rate else 0
+
+    def _warm_save(self):
+        if self._warm_store is None or not self._info:
+            return
+        self._warm_store.save({
+            'info': self._info,
+            'rename': self._nodes.aliases(),
+            'nodes': self._nodes.attached(),
+        })
+
+    def _warm_restore(self):
+        """Restore the gateway info, aliases and nodes of the last run, the handshake reconciles them"""
+        state = self._warm_store.load(None)
+        try:
+            info = state['info']
+            renames = {str(k): str(v) for k, v in state['rename'].items()}
+            nodes = [str(address) for address in state['nodes']]
+            info_id = info['id']
+        except (TypeError, KeyError, AttributeError):
+            return
+
+        logging.info('Warm start with %d nodes', len(nodes))
+
+        self._info_id = self._warm_info_id = info_id
+        self._info = info
+        self._rename()
+
+        self._warm_renames = set()
+        for address, name in renames.items():
+            if self._nodes.alias(address) is not None or self._nodes.address(name) is not None:
+                continue
+            self._nodes.set_alias(address, name)
+            self._warm_renames.add(address)
+        self._topic_cache_clear()
+
+        self._warm_nodes = set(nodes)
+        for address in nodes:
+            self.node_add(address)
+
+    def _warm_reconcile_renames(self, aliases):
+        for address in self._warm_renames:
+            if address not in aliases and address != self._info_id:
+                self._warm_forget_rename(address)
+        self._warm_renames = None
+
+    def _warm_reconcile_nodes(self, nodes):
+        for address in self._warm_nodes - nodes:
+            if address != self._info_id:
+                self.node_remove(address)
+        self._warm_nodes = None
+        self._warm_info_id = None
+
+    def _warm_discard(self):
+        logging.info('Warm start state is for another gateway')
+        for address in self._warm_nodes or ():
+            self.node_remove(address)
+        for address in self._warm_renames or ():
+            self._warm_forget_rename(address)
+        self._warm_nodes = None
+        self._warm_renames = None
+        self._warm_info_id = None
+
+    def _warm_forget_rename(self, address):
+        name = self._nodes.set_alias(address, None)
+        if name is None:
+            return
+        self._topic_cache_invalidate(address)
+        self.sub_remove(['node', name, '+/+/+/+'])
+
     def _save_nodes_json(self):
         if not self._data_dir:
             return
 
-        try:
-            json.dump(self._nodes, open(os.path.join(self._data_dir, 'nodes.json'), 'w', encoding="utf-8"))
-        except Exception as e:
-            logging.warning(str(e))
+        self._nodes_store.save(self._nodes.info_cache())
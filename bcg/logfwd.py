@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import time
+
+log_level_lut = {'D': 'debug', 'I': 'info', 'W': 'warning', 'E': 'error'}
+
+LEVELS = ('debug', 'info', 'warning', 'error')
+
+
+class LogForwarder:
+    """Firmware log lines ("#<time> <L> text") on the way to MQTT.
+
+    Lines below the minimum level are dropped first. A line equal to the last
+    forwarded one apart from its time is only counted, the count is forwarded
+    as the last of the repeated lines with " (repeated N times)" appended when
+    a different line comes or at the next flush(). New lines take a token from
+    a bucket of burst tokens refilled at rate per second and are dropped when
+    it is empty. With batch the lines are collected and forwarded as one list
+    of [level, line] by flush().
+    """
+
+    def __init__(self, publish, level='debug', rate=0, burst=20, collapse=False, batch=False):
+        self._publish = publish
+        self._min_level = LEVELS.index(level)
+        self._rate = rate
+        self._burst = burst
+        self._tokens = burst
+        self._tokens_time = None
+        self._collapse = collapse
+        self._batch = [] if batch else None
+
+        self._last_key = None
+        self._last_level = None
+        self._last_line = None
+        self._repeats = 0
+
+        self.dropped = 0
+        self.collapsed = 0
+
+    def add(self, line, now=None):
+        i = line.find('<')
+        level = log_level_lut.get(line[i + 1:i + 2], 'debug') if i >= 0 else 'debug'
+        if LEVELS.index(level) < self._min_level:
+            return
+
+        line = line[1:].strip()
+
+        if self._collapse:
+            j = line.find('<')
+            key = line[j:] if j >= 0 else line
+            if key == self._last_key:
+                self._repeats += 1
+                self._last_line = line
+                self.collapsed += 1
+                return
+            self._repeat_flush()
+
+        if self._rate:
+            if now is None:
+                now = time.monotonic()
+            if self._tokens_time is not None:
+                self._tokens = min(self._burst, self._tokens + (now - self._tokens_time) * self._rate)
+            self._tokens_time = now
+            if self._tokens < 1:
+                self.dropped += 1
+                return
+            self._tokens -= 1
+
+        if self._collapse:
+            self._last_key = key
+            self._last_level = level
+
+        self._forward(level, line)
+
+    def _repeat_flush(self):
+        if self._repeats:
+            self._forward(self._last_level, '%s (repeated %d times)' % (self._last_line, self._repeats))
+            self._repeats = 0
+
+    def _forward(self, level, line):
+        if self._batch is None:
+            self._publish(level, line)
+        else:
+            self._batch.append([level, line])
+
+    def flush(self):
+        self._repeat_flush()
+        if self._batch:
+            batch = self._batch
+            self._batch = []
+            self._publish('batch', batch)
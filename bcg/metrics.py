@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import bisect
+import logging
+import threading
+
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+class Counter:
+    # incremented from the serial and the MQTT threads of the thread engine
+    __slots__ = ('_value', '_lock')
+
+    def __init__(self):
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, n=1):
+        with self._lock:
+            self._value += n
+
+    @property
+    def value(self):
+        with self._lock:
+            return self._value
+
+
+class LabeledGauge:
+    __slots__ = ('_fn',)
+
+    def __init__(self, fn):
+        self._fn = fn
+
+    @property
+    def values(self):
+        return self._fn()
+
+
+class Gauge:
+    __slots__ = ('_fn',)
+
+    def __init__(self, fn):
+        self._fn = fn
+
+    @property
+    def value(self):
+        return self._fn()
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Upper bound of the bucket containing the q quantile, None if unknown or above the last bucket"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        total = 0
+        for i, n in enumerate(self.counts):
+            total += n
+            if total >= rank:
+                return self.buckets[i] if i < len(self.buckets) else None
+        return None
+
+
+class Registry:
+    """Metrics of one gateway.
+
+    Counters may be incremented from any thread. Histograms are observed by
+    the serial thread only and labeled metrics are read from the state of the
+    gateway when collected.
+    """
+
+    def __init__(self):
+        self._metrics = []
+
+    def _add(self, name, help, kind, metric, label=None):
+        self._metrics.append((name, help, kind, metric, label))
+        return metric
+
+    def counter(self, name, help):
+        return self._add(name, help, 'counter', Counter())
+
+    def gauge(self, name, help, fn, kind='gauge'):
+        """Value read from fn when collected, kind is 'counter' for totals kept elsewhere"""
+        return self._add(name, help, kind, Gauge(fn))
+
+    def labeled_gauge(self, name, help, label, fn, kind='gauge'):
+        """Values by label read from fn, which returns a dict, when collected"""
+        return self._add(name, help, kind, LabeledGauge(fn), label)
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS):
+        return self._add(name, help, 'histogram', Histogram(buckets))
+
+    def snapshot(self):
+        """Return the values as a dict ready to be published as JSON"""
+        data = {}
+        for name, help, kind, metric, label in self._metrics:
+            if isinstance(metric, LabeledGauge):
+                data[name] = dict(metric.values)
+            elif isinstance(metric, Histogram):
+                data[name] = {'count': metric.count, 'sum': round(metric.sum, 6),
+                              'p50': metric.quantile(0.5), 'p99': metric.quantile(0.99)}
+            else:
+                data[name] = metric.value
+        return data
+
+    def prometheus(self, labels, emitted=None):
+        """Return the metrics in Prometheus text format, HELP and TYPE are written once per name in emitted"""
+        if emitted is None:
+            emitted = set()
+
+        common = ','.join('%s="%s"' % (k, _escape(v)) for k, v in labels.items())
+        lines = []
+
+        for name, help, kind, metric, label in self._metrics:
+            name = 'bcg_' + name
+            if name not in emitted:
+                emitted.add(name)
+                lines.append('# HELP %s %s' % (name, help))
+                lines.append('# TYPE %s %s' % (name, kind))
+
+            if isinstance(metric, LabeledGauge):
+                for value, n in dict(metric.values).items():
+                    lines.append('%s{%s} %s' % (name, _join(common, '%s="%s"' % (label, _escape(value))), n))
+            elif isinstance(metric, Histogram):
+                total = 0
+                for bound, n in zip(metric.buckets + (float('inf'),), list(metric.counts)):
+                    total += n
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append('%s_bucket{%s} %d' % (name, _join(common, 'le="%s"' % le), total))
+                lines.append('%s_sum{%s} %s' % (name, common, repr(metric.sum)))
+                lines.append('%s_count{%s} %d' % (name, common, metric.count))
+            else:
+                lines.append('%s{%s} %s' % (name, common, metric.value))
+
+        return lines
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _join(a, b):
+    return a + ',' + b if a else b
+
+
+def prometheus_text(gateways):
+    emitted = set()
+    lines = []
+    for gateway in gateways:
+        lines.extend(gateway.metrics.prometheus({'gateway': gateway.name or ''}, emitted))
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_server_start(config, gateways):
+    """Serve the metrics of the gateways in Prometheus text format if metrics.http_port is set"""
+    port = config['metrics']['http_port']
+    if not port:
+        return None
+
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = prometheus_text(gateways).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logging.debug('metrics: ' + format, *args)
+
+    server = ThreadingHTTPServer((config['metrics']['http_host'], port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+
+    logging.info('Metrics on http://%s:%d/metrics', config['metrics']['http_host'], port)
+
+    return server
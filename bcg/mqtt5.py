@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import heapq
+import logging
+import threading
+import paho.mqtt
+from looseversion import LooseVersion
+
+# MQTT v5 properties came with 1.5, 2.0 changed the callback and client API and
+# session_start relies on the queue of unacknowledged messages of the 1.x client
+PAHO_VERSIONS = ('1.5.0', '2.0')
+
+if not LooseVersion(PAHO_VERSIONS[0]) <= LooseVersion(paho.mqtt.__version__) < LooseVersion(PAHO_VERSIONS[1]):
+    raise ImportError('paho-mqtt %s is installed, bcg needs >= %s and < %s' % ((paho.mqtt.__version__,) + PAHO_VERSIONS))
+
+import paho.mqtt.client  # noqa: E402
+from paho.mqtt.properties import Properties  # noqa: E402
+from paho.mqtt.packettypes import PacketTypes  # noqa: E402
+from bcg.topic import TopicMatcher  # noqa: E402
+
+# publishes between two reassignments of the topic aliases
+REBALANCE_PERIOD = 1024
+
+
+class TopicAliases:
+    """Topic aliases of one MQTT v5 connection.
+
+    A topic gets a free alias on its second publish. Every REBALANCE_PERIOD
+    publishes the aliases move to the topics published most often since the
+    last rebalance. The first message with a newly assigned alias carries the
+    topic, the following ones the alias only.
+
+    Messages with QoS 0 are sent at once while QoS 1 and 2 ones may wait for
+    the inflight window, so an alias is reused only for a topic with the same
+    kind of QoS, the broker never sees the two kinds out of order on one alias.
+    """
+
+    def __init__(self, limit):
+        self._limit = limit
+        self.reset(0)
+
+    def reset(self, maximum):
+        """Start a new connection, the broker accepts maximum aliases"""
+        self.maximum = min(self._limit, maximum)
+        self._aliases = {}  # topic: [alias, reliable, established]
+        self._topics = {}  # alias: topic
+        self._reliable = {}  # alias: reliable
+        self._free = list(range(self.maximum, 0, -1))
+        self._counts = {}
+        self._unaliased = {}  # topic: reliable, of the counted topics without an alias
+        self._publishes = 0
+
+    def topic(self, alias):
+        return self._topics.get(alias)
+
+    def get(self, topic, qos):
+        """Return (alias, established) for a publish to topic, alias None if the topic has none"""
+        if not self.maximum:
+            return None, False
+
+        counts = self._counts
+        count = counts[topic] = counts.get(topic, 0) + 1
+
+        self._publishes += 1
+        if self._publishes >= REBALANCE_PERIOD:
+            self._rebalance()
+
+        reliable = qos > 0
+        entry = self._aliases.get(topic)
+
+        if entry is None:
+            entry = self._assign(topic, reliable) if count >= 2 and self._free else None
+            if entry is None:
+                self._unaliased[topic] = reliable
+                return None, False
+
+        if entry[1] != reliable:
+            return None, False
+
+        established = entry[2]
+        entry[2] = True
+        return entry[0], established
+
+    def _assign(self, topic, reliable):
+        for i in range(len(self._free) - 1, -1, -1):
+            alias = self._free[i]
+            if self._reliable.setdefault(alias, reliable) == reliable:
+                del self._free[i]
+                entry = self._aliases[topic] = [alias, reliable, False]
+                self._topics[alias] = topic
+                return entry
+        return None
+
+    def _rebalance(self):
+        counts = self._counts
+        aliases = self._aliases
+
+        # on equal counts the topics keeping their alias win
+        hot = set(heapq.nlargest(self.maximum, counts, key=lambda topic: (counts[topic], topic in aliases)))
+
+        for topic in [topic for topic in aliases if topic not in hot]:
+            alias = aliases.pop(topic)[0]
+            del self._topics[alias]
+            self._free.append(alias)
+
+        for topic in hot:
+            if topic not in aliases and counts[topic] >= 2 and topic in self._unaliased:
+                self._assign(topic, self._unaliased[topic])
+
+        self._counts = {}
+        self._unaliased = {}
+        self._publishes = 0
+
+
+class MqttV5Client(paho.mqtt.client.Client):
+    """MQTT v5 client which shortens the published topics by topic aliases and sets the message expiry.
+
+    session_start() must be called from on_connect with the CONNACK properties,
+    it learns the alias limit of the broker and restores the topics of the
+    messages paho is going to send again, the aliases of the previous
+    connection are not valid any more.
+    """
+
+    def __init__(self, config):
+        mqtt = config['mqtt']
+        super().__init__(mqtt.get('client_id', ''), protocol=paho.mqtt.client.MQTTv5)
+        self._session_expiry = mqtt['session_expiry']
+        self.expiry_set(config['base_topic_prefix'], mqtt['message_expiry'])
+        self._aliases = TopicAliases(mqtt['topic_aliases'])
+        self._alias_properties = {}  # (alias, expiry): Properties
+        self._alias_messages = {}  # mid: topic, of the queued messages sent with the alias only
+        self._alias_prune_at = 2 * REBALANCE_PERIOD
+        self._publish_lock = threading.Lock()
+
+    def expiry_set(self, prefix, rules):
+        """Set the message_expiry rules, the topics of the rules get the prefix"""
+        self._expiry = TopicMatcher((prefix + rule['topic'], rule['expiry']) for rule in rules)
+
+    def connect_async(self, host, port=1883, keepalive=60, bind_address="", bind_port=0,
+                      clean_start=paho.mqtt.client.MQTT_CLEAN_START_FIRST_ONLY, properties=None):
+        if properties is None and self._session_expiry:
+            properties = Properties(PacketTypes.CONNECT)
+            properties.SessionExpiryInterval = self._session_expiry
+        return super().connect_async(host, port, keepalive, bind_address, bind_port, clean_start, properties)
+
+    def session_start(self, properties):
+        with self._publish_lock:
+            with self._out_message_mutex:
+                for message in self._out_messages.values():
+                    if message.properties is not None and hasattr(message.properties, 'TopicAlias'):
+                        topic = message.topic or self._alias_messages.get(message.mid)
+                        if topic is None:
+                            continue
+                        message.topic = topic.encode('utf-8')
+                        message.properties = self._properties(None, self._expiry.match(topic))
+            self._alias_messages = {}
+            self._alias_prune_at = 2 * REBALANCE_PERIOD
+
+            self._aliases.reset(getattr(properties, 'TopicAliasMaximum', 0))
+            logging.debug('MQTT topic aliases: %d', self._aliases.maximum)
+
+    def session_end(self):
+        """Called from on_disconnect, messages published until the next session_start go without aliases"""
+        with self._publish_lock:
+            self._aliases.reset(0)
+
+    def _properties(self, alias, expiry):
+        key = (alias, expiry)
+        properties = self._alias_properties.get(key)
+        if properties is None and (alias or expiry):
+            properties = Properties(PacketTypes.PUBLISH)
+            if alias:
+                properties.TopicAlias = alias
+            if expiry:
+                properties.MessageExpiryInterval = expiry
+            self._alias_properties[key] = properties
+        return properties
+
+    def publish(self, topic, payload=None, qos=0, retain=False, properties=None):
+        if properties is not None:
+            return super().publish(topic, payload, qos, retain, properties)
+
+        expiry = self._expiry.match(topic)
+
+        with self._publish_lock:
+            alias, established = self._aliases.get(topic, qos)
+            properties = self._properties(alias, expiry)
+            if not established:
+                return super().publish(topic, payload, qos, retain, properties)
+
+            info = super().publish('', payload, qos, retain, properties)
+            if qos:
+                self._alias_messages[info.mid] = topic
+                if len(self._alias_messages) > self._alias_prune_at:
+                    self._alias_messages_prune()
+            return info
+
+    def _alias_messages_prune(self):
+        with self._out_message_mutex:
+            self._alias_messages = {mid: topic for mid, topic in self._alias_messages.items() if mid in self._out_messages}
+        self._alias_prune_at = 2 * max(REBALANCE_PERIOD, len(self._alias_messages))
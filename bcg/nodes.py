@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+class Node:
+    __slots__ = ('id', 'alias', 'eeprom_alias', 'info', 'attached', 'messages', 'last_seen')
+
+    def __init__(self, id):
+        self.id = id
+        self.alias = None
+        self.eeprom_alias = None
+        self.info = None
+        self.attached = False
+        self.messages = 0
+        self.last_seen = None
+
+    def __repr__(self):
+        return 'Node(%r, alias=%r, attached=%r)' % (self.id, self.alias, self.attached)
+
+
+class NodeRegistry:
+    """Nodes of one gateway indexed by id and by alias.
+
+    A record is kept while the node is attached, has an alias (the MQTT name),
+    an alias stored in the gateway EEPROM or cached firmware info, and is
+    dropped together with its message statistics when none of them is left.
+    Messages of ids without a record are not counted, so ids heard on the
+    radio which never attach do not pile up.
+    An alias belongs to one node only, giving it to another node takes it
+    from the first one.
+    """
+
+    def __init__(self):
+        self._by_id = {}
+        self._by_alias = {}
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def get(self, address):
+        return self._by_id.get(address)
+
+    def _node(self, address):
+        node = self._by_id.get(address)
+        if node is None:
+            node = self._by_id[address] = Node(address)
+        return node
+
+    def _prune(self, node):
+        if not node.attached and node.alias is None and node.eeprom_alias is None and node.info is None:
+            if self._by_id.get(node.id) is node:
+                del self._by_id[node.id]
+
+    # attached nodes
+
+    def is_attached(self, address):
+        node = self._by_id.get(address)
+        return node is not None and node.attached
+
+    def attached(self):
+        return [node.id for node in list(self._by_id.values()) if node.attached]
+
+    def attach(self, address):
+        """Return the node if it was not attached before, None otherwise"""
+        node = self._node(address)
+        if node.attached:
+            return None
+        node.attached = True
+        return node
+
+    def detach(self, address):
+        """Return the node if it was attached, None otherwise"""
+        node = self._by_id.get(address)
+        if node is None or not node.attached:
+            return None
+        node.attached = False
+        self._prune(node)
+        return node
+
+    def describe(self, nodes):
+        """Add alias, firmware and version to the {"id": ...} items of a /nodes response"""
+        for item in nodes:
+            node = self._by_id.get(item['id'])
+            if node is None:
+                continue
+            if node.alias:
+                item['alias'] = node.alias
+            if node.info:
+                item['firmware'] = node.info.get('firmware')
+                item['version'] = node.info.get('version')
+        return nodes
+
+    # aliases
+
+    def alias(self, address):
+        node = self._by_id.get(address)
+        return None if node is None else node.alias
+
+    def address(self, alias):
+        node = self._by_alias.get(alias)
+        return None if node is None else node.id
+
+    def set_alias(self, address, alias):
+        """Set or remove (None) the alias of the node, return the previous one"""
+        node = self._by_id.get(address)
+        if node is None:
+            if alias is None:
+                return None
+            node = self._node(address)
+
+        old = node.alias
+        if old is not None and self._by_alias.get(old) is node:
+            del self._by_alias[old]
+
+        node.alias = alias
+        if alias is not None:
+            other = self._by_alias.get(alias)
+            if other is not None and other is not node:
+                other.alias = None
+                self._prune(other)
+            self._by_alias[alias] = node
+        else:
+            self._prune(node)
+
+        return old
+
+    def aliases(self):
+        return {node.id: node.alias for node in list(self._by_id.values()) if node.alias is not None}
+
+    # aliases in the gateway EEPROM
+
+    def eeprom_alias(self, address):
+        node = self._by_id.get(address)
+        return None if node is None else node.eeprom_alias
+
+    def set_eeprom_alias(self, address, alias):
+        """Set or remove (None) the EEPROM alias of the node, return the previous one"""
+        node = self._by_id.get(address) if alias is None else self._node(address)
+        if node is None:
+            return None
+        old = node.eeprom_alias
+        node.eeprom_alias = alias
+        self._prune(node)
+        return old
+
+    def eeprom_aliases(self):
+        return {node.id: node.eeprom_alias for node in list(self._by_id.values()) if node.eeprom_alias is not None}
+
+    def eeprom_clear(self):
+        for node in list(self._by_id.values()):
+            if node.eeprom_alias is not None:
+                node.eeprom_alias = None
+                self._prune(node)
+
+    # firmware info
+
+    def set_info(self, address, info):
+        self._node(address).info = info
+
+    def info_load(self, cache):
+        """Replace the firmware info of the detached nodes by the {id: {"info": ...}} cache"""
+        for node in list(self._by_id.values()):
+            if not node.attached and node.info is not None:
+                node.info = None
+                self._prune(node)
+
+        for address, item in cache.items():
+            info = item.get('info') if isinstance(item, dict) else None
+            if info:
+                node = self._node(address)
+                if node.info is None:
+                    node.info = info
+
+    def info_cache(self):
+        """Return the firmware info of the attached nodes in the format of info_load"""
+        return {node.id: {'info': node.info} if node.info else {} for node in list(self._by_id.values()) if node.attached}
+
+    # statistics
+
+    def seen(self, address, now):
+        """Count a message from the node received at now (time.monotonic)"""
+        node = self._by_id.get(address)
+        if node is None:
+            return
+        node.messages += 1
+        node.last_seen = now
+
+    def message_counts(self):
+        return {node.id: node.messages for node in list(self._by_id.values()) if node.messages}
+
+    def last_seen(self, now):
+        """Return the seconds since the last message of every node which has sent one"""
+        return {node.id: round(now - node.last_seen, 3) for node in list(self._by_id.values()) if node.last_seen is not None}
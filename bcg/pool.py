@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import logging
+from bcg.config import device_configs
+from bcg.gateway import mqtt_client_create, mqtt_callbacks_add, mqtt_callbacks_remove, mqtt_log_connect
+from bcg.mqtt5 import MqttV5Client
+from bcg.aio import AsyncioGateway, run
+from bcg.metrics import metrics_server_start
+
+
+class GatewayPool:
+    """Several serial gateways multiplexed on one MQTT connection and one event loop"""
+
+    def __init__(self, config, devices):
+        self._config = config
+        self._prefix = config['base_topic_prefix']
+
+        self.mqttc = mqtt_client_create(config)
+        self.mqttc.on_connect = self.mqtt_on_connect
+        self.mqttc.on_message = self.mqtt_on_message
+        self.mqttc.on_disconnect = self.mqtt_on_disconnect
+        self.mqttc.on_publish = self.mqtt_on_publish
+        mqtt_callbacks_add(self.mqttc, self._prefix, self)
+
+        self.gateways = [AsyncioGateway(device_config, self.mqttc) for device_config in devices]
+
+    def start(self, reconect):
+        for gateway in self.gateways:
+            gateway._log_start()
+        metrics_server_start(self._config, self.gateways)
+        run(self.mqttc, self._config, self.gateways, reconect)
+
+    def watch_config(self, reloader):
+        self.gateways[0].watch_config(reloader)
+
+    def config_reload(self, config):
+        devices = {device_config['device']: device_config for device_config in device_configs(config)}
+        if set(devices) != set(gateway._config['device'] for gateway in self.gateways):
+            logging.warning('Changed devices need a restart')
+
+        prefix = config['base_topic_prefix']
+        if prefix != self._prefix:
+            mqtt_callbacks_remove(self.mqttc, self._prefix)
+            mqtt_callbacks_add(self.mqttc, prefix, self)
+            self._prefix = prefix
+            if isinstance(self.mqttc, MqttV5Client):
+                self.mqttc.expiry_set(prefix, self._config['mqtt']['message_expiry'])
+
+        for gateway in self.gateways:
+            device_config = devices.get(gateway._config['device'])
+            if device_config is not None:
+                gateway.config_reload(device_config)
+
+    def mqtt_on_connect(self, client, userdata, flags, rc, properties=None):
+        if mqtt_log_connect(rc):
+            if isinstance(client, MqttV5Client):
+                client.session_start(properties)
+            for gateway in self.gateways:
+                gateway.mqtt_connected(client)
+
+    def mqtt_on_disconnect(self, client, userdata, rc, properties=None):
+        logging.info('Disconnect from MQTT broker with code %s', rc)
+        if isinstance(client, MqttV5Client):
+            client.session_end()
+        for gateway in self.gateways:
+            gateway.mqtt_disconnected()
+
+    def mqtt_on_publish(self, client, userdata, mid):
+        for gateway in self.gateways:
+            gateway.mqtt_on_publish(client, userdata, mid)
+
+    def mqtt_on_message(self, client, userdata, message):
+        topic = message.topic[len(self._prefix):]
+
+        for gateway in self.gateways:
+            if gateway.mqtt_route(topic):
+                gateway.mqtt_on_message(client, userdata, message)
+                return
+
+        logging.debug('No gateway for message %s', message.topic)
+
+    def gateway_ping(self, *args):
+        for gateway in self.gateways:
+            gateway.gateway_ping(*args)
+
+    def gateway_all_info_get(self, *args):
+        for gateway in self.gateways:
+            gateway.gateway_all_info_get(*args)
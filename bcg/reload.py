@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import signal
+import logging
+import threading
+
+
+class ConfigReloader:
+    """Reload the configuration file on SIGHUP or when it changes.
+
+    poll() is run by the scheduler of a gateway, so the new configuration is
+    loaded and applied in the thread which owns the gateway state, the signal
+    handler only sets a flag. With interval 0 the file is read on SIGHUP only.
+    A configuration which does not load or validate is logged and ignored.
+    """
+
+    def __init__(self, path, load, apply, interval=2.0):
+        self.path = path
+        self.interval = interval or 1.0
+        self._load = load
+        self._apply = apply
+        self._watch = bool(interval)
+        self._stamp = self._stat()
+        self._requested = False
+
+        if hasattr(signal, 'SIGHUP') and threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGHUP, self._sighup)
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _sighup(self, signum, frame):
+        self._requested = True
+
+    def poll(self):
+        if self._watch:
+            stamp = self._stat()
+            if stamp != self._stamp:
+                self._stamp = stamp
+                self._requested = stamp is not None
+
+        if not self._requested:
+            return
+        self._requested = False
+
+        logging.info('Reload configuration %s', self.path)
+        try:
+            config = self._load()
+        except Exception as e:
+            logging.error('Configuration not reloaded: %s', e)
+            return
+
+        self._apply(config)
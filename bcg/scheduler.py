@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import time
+import logging
+
+
+class Scheduler:
+    """Periodic jobs run from the thread that owns the gateway state.
+
+    The engine calls poll() regularly: the threaded engine after every serial
+    read, the asyncio engine from a task.
+    """
+
+    def __init__(self):
+        self._jobs = []
+
+    def every(self, interval, callback):
+        job = [time.monotonic() + interval, interval, callback]
+        self._jobs.append(job)
+        return job
+
+    def cancel(self, job):
+        if job in self._jobs:
+            self._jobs.remove(job)
+
+    def poll(self, now=None):
+        """Run the due jobs, return seconds to the next one or None if there is none"""
+        if not self._jobs:
+            return None
+
+        if now is None:
+            now = time.monotonic()
+
+        wait = None
+        for job in list(self._jobs):
+            if job[0] <= now:
+                job[0] = now + job[1]
+                try:
+                    job[2]()
+                except Exception as e:
+                    logging.error('Periodic job %s failed: %s', getattr(job[2], '__name__', job[2]), e)
+            if wait is None or job[0] - now < wait:
+                wait = job[0] - now
+
+        return max(wait, 0)
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import time
+import gzip
+import zlib
+import logging
+import threading
+import json
+from json.encoder import encode_basestring_ascii
+
+
+def _segment_start(name):
+    """Return the start time in ms of the segment file name, None for other files"""
+    if name.startswith('sink-') and name.endswith('.ndjson.gz') and name[5:-10].isdigit():
+        return int(name[5:-10])
+    return None
+
+
+def _segments(directory):
+    """Return the segments in the directory as sorted [start_ms, path]"""
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return []
+    segments = []
+    for name in names:
+        start = _segment_start(name)
+        if start is not None:
+            segments.append([start, os.path.join(directory, name)])
+    segments.sort()
+    return segments
+
+
+class Sink:
+    """Local time series of the node messages in rotating gzip NDJSON segments.
+
+    Every line is [timestamp, id, alias, subtopic, value] with the timestamp in
+    seconds since the epoch first, so a time range is found without parsing
+    the rest of the line. The payloads are stored as encoded for MQTT. Lines
+    are buffered up to memory_limit bytes or sync_interval seconds and each
+    flush appends one gzip member to the segment and syncs it, a crash loses
+    the unsynced lines only. A segment is closed when it has segment_size
+    bytes or is segment_time seconds old, the segments older than
+    retention_time seconds or over retention_size bytes in total are deleted.
+    """
+
+    def __init__(self, directory, memory_limit=65536, sync_interval=5.0, segment_size=4194304, segment_time=3600,
+                 retention_time=0, retention_size=0, compress_level=6):
+        self.directory = directory
+        self._memory_limit = memory_limit
+        self._sync_interval = sync_interval
+        self._segment_size = segment_size
+        self._segment_time = segment_time
+        self._retention_time = retention_time
+        self._retention_size = retention_size
+        self._compress_level = compress_level
+
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._buffer_size = 0
+        self._buffer_time = 0
+        self._synced = time.monotonic()
+
+        self._file = None
+        self._file_size = 0
+        self._file_start = 0
+
+        os.makedirs(directory, exist_ok=True)
+        # [start_ms, path, size] of the closed segments, a new run never appends to a segment of the last one
+        self._segments = [[start, path, os.path.getsize(path)] for start, path in _segments(directory)]
+
+        self.written = 0
+
+    def add(self, address, alias, subtopic, payload, now=None):
+        """Add the encoded payload (str or bytes) of the node message"""
+        if isinstance(payload, bytes):
+            payload = payload.decode('utf-8', 'replace')
+        if now is None:
+            now = time.time()
+
+        line = '[%.3f, %s, %s, %s, %s]\n' % (now, encode_basestring_ascii(address), encode_basestring_ascii(alias) if alias else 'null',
+                                             encode_basestring_ascii(subtopic), payload)
+
+        with self._lock:
+            if not self._buffer:
+                self._buffer_time = now
+            self._buffer.append(line)
+            self._buffer_size += len(line)
+
+            if self._buffer_size >= self._memory_limit or time.monotonic() - self._synced >= self._sync_interval:
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        self._synced = time.monotonic()
+
+        if not self._buffer:
+            return
+
+        if self._file is not None and (self._file_size >= self._segment_size or self._buffer_time - self._file_start / 1000 >= self._segment_time):
+            self._close()
+        if self._file is None:
+            self._open(int(self._buffer_time * 1000))
+
+        data = zlib.compressobj(self._compress_level, zlib.DEFLATED, 31)
+        data = data.compress(''.join(self._buffer).encode('utf-8')) + data.flush()
+        count = len(self._buffer)
+        self._buffer = []
+        self._buffer_size = 0
+
+        try:
+            self._file.write(data)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file_size += len(data)
+            self.written += count
+        except OSError as e:
+            logging.error('Sink write failed: %s', e)
+
+    def _open(self, start):
+        if self._segments and start <= self._segments[-1][0]:
+            start = self._segments[-1][0] + 1
+        path = os.path.join(self.directory, 'sink-%013d.ndjson.gz' % start)
+        self._file = open(path, 'ab')
+        self._file_size = 0
+        self._file_start = start
+        self._retention()
+
+    def _close(self):
+        self._file.close()
+        self._segments.append([self._file_start, self._file.name, self._file_size])
+        self._file = None
+
+    def _retention(self):
+        # the end of a segment is the start of the next one
+        if self._retention_time:
+            limit = (time.time() - self._retention_time) * 1000
+            while len(self._segments) > 1 and self._segments[1][0] < limit:
+                self._remove()
+            if self._segments and self._file_start < limit:
+                self._remove()
+
+        if self._retention_size:
+            total = sum(segment[2] for segment in self._segments)
+            while self._segments and total > self._retention_size:
+                total -= self._remove()
+
+    def _remove(self):
+        start, path, size = self._segments.pop(0)
+        try:
+            os.remove(path)
+        except OSError as e:
+            logging.error('Sink remove failed: %s', e)
+        return size
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            if self._file is not None:
+                self._close()
+
+
+def export(directory, since=None, until=None, nodes=None):
+    """Yield the lines of the sink in directory with since <= timestamp < until.
+
+    nodes is a set of node ids and aliases to export, None for all. Only the
+    segments overlapping the range are decompressed and the time is compared
+    without parsing the line. The unfinished gzip member a crash leaves at the
+    end of a segment ends its lines.
+    """
+    if nodes is not None:
+        nodes = (set(nodes), [encode_basestring_ascii(node) for node in nodes])
+
+    segments = _segments(directory)
+    for i, (start, path) in enumerate(segments):
+        if until is not None and start >= until * 1000:
+            break
+        if since is not None and i + 1 < len(segments) and segments[i + 1][0] <= since * 1000:
+            continue
+
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                for line in f:
+                    if since is not None or until is not None:
+                        timestamp = float(line[1:line.index(',')])
+                        if since is not None and timestamp < since:
+                            continue
+                        if until is not None and timestamp >= until:
+                            break
+                    if nodes is not None and not _node_match(line, nodes):
+                        continue
+                    yield line
+        except (EOFError, OSError, zlib.error) as e:
+            logging.warning('Sink segment %s truncated: %s', path, e)
+
+
+def _node_match(line, nodes):
+    # only the lines containing one of the JSON encoded names are parsed to compare the whole id and alias fields
+    names, encoded = nodes
+    if not any(node in line for node in encoded):
+        return False
+    try:
+        fields = json.loads(line)
+    except ValueError:
+        return False
+    return fields[1] in names or fields[2] in names
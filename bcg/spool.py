@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import time
+import struct
+import logging
+import threading
+from bcg.topic import TopicMatcher
+
+_HEADER = struct.Struct('!BHI')
+
+
+class Spool:
+    """Append-only on-disk log of MQTT messages published while the broker is not reachable.
+
+    Messages are buffered in memory up to memory_limit bytes or sync_interval
+    seconds, then appended to the current segment file and synced in one batch.
+    read() returns the messages in order, a segment is deleted when all its
+    messages are read and acknowledged with ack(), the segments left are replayed
+    again by the next run. For topics matching a compact pattern only the latest
+    message is replayed.
+    """
+
+    def __init__(self, directory, memory_limit=65536, sync_interval=1.0, segment_size=1048576, compact=()):
+        self.directory = directory
+        self._memory_limit = memory_limit
+        self._sync_interval = sync_interval
+        self._segment_size = segment_size
+        self._compact = TopicMatcher((pattern, True) for pattern in compact)
+
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._buffer_size = 0
+        self._synced = time.monotonic()
+
+        self._file = None
+        self._file_size = 0
+
+        self._read_file = None
+        self._read_segment = None
+        self._latest = None
+        # messages returned by read() and not acknowledged yet per segment, segments read to the end
+        self._unacked = {}
+        self._done = set()
+
+        os.makedirs(directory, exist_ok=True)
+        self._segments = sorted(int(name[6:-4]) for name in os.listdir(directory) if name.startswith('spool-') and name.endswith('.bin'))
+        self._segment_next = self._segments[-1] + 1 if self._segments else 0
+        self.active = bool(self._segments)
+        self.spooled = 0
+        self.replayed = 0
+
+        if self._segments:
+            logging.info('Spool %s contains %d segments', directory, len(self._segments))
+
+    def compact_set(self, compact):
+        """Replace the compact topic patterns, e.g. after base_topic_prefix changed"""
+        matcher = TopicMatcher((pattern, True) for pattern in compact)
+        with self._lock:
+            self._compact = matcher
+            # the positions of the latest messages are scanned again with the new patterns
+            self._latest = None
+
+    def _path(self, segment):
+        return os.path.join(self.directory, 'spool-%08d.bin' % segment)
+
+    def offer(self, topic, payload, qos, retain, connected):
+        """Spool the message if the broker is not connected or older messages wait for replay"""
+        with self._lock:
+            if connected and not self.active:
+                return False
+
+            if isinstance(payload, str):
+                payload = payload.encode('utf-8')
+            topic = topic.encode('utf-8')
+
+            self._buffer.append(_HEADER.pack(qos | (retain << 2), len(topic), len(payload)) + topic + payload)
+            self._buffer_size += _HEADER.size + len(topic) + len(payload)
+            self.active = True
+            self.spooled += 1
+
+            if self._buffer_size >= self._memory_limit or time.monotonic() - self._synced >= self._sync_interval:
+                self._flush()
+
+        return True
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        self._synced = time.monotonic()
+
+        if not self._buffer:
+            return
+
+        if self._file is None or self._file_size >= self._segment_size:
+            self._rotate()
+
+        if self._latest is not None:
+            self._latest_update()
+
+        data = b''.join(self._buffer)
+        self._buffer = []
+        self._buffer_size = 0
+
+        try:
+            self._file.write(data)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file_size += len(data)
+        except OSError as e:
+            logging.error('Spool write failed: %s', e)
+
+    def _latest_update(self):
+        # a replay is running, the buffered messages of compacted topics become the latest ones
+        segment = self._segments[-1]
+        pos = self._file_size
+        for record in self._buffer:
+            topic_len = _HEADER.unpack_from(record)[1]
+            topic = record[_HEADER.size:_HEADER.size + topic_len].decode('utf-8')
+            if self._compact.match(topic):
+                self._latest[topic] = (segment, pos)
+            pos += len(record)
+
+    def _rotate(self):
+        if self._file is not None:
+            self._file.close()
+
+        # segments waiting for acknowledgement keep their numbers
+        segment = self._segment_next
+        self._segment_next += 1
+        self._file = open(self._path(segment), 'ab')
+        self._file_size = 0
+        self._segments.append(segment)
+
+    def _records(self, f):
+        while True:
+            header = f.read(_HEADER.size)
+            if len(header) < _HEADER.size:
+                return
+            flags, topic_len, payload_len = _HEADER.unpack(header)
+            data = f.read(topic_len + payload_len)
+            if len(data) < topic_len + payload_len:
+                return
+            yield data[:topic_len].decode('utf-8'), data[topic_len:], flags & 0x03, bool(flags & 0x04)
+
+    def _scan_latest(self):
+        # position of the last message for every compacted topic
+        latest = {}
+        for segment in self._segments:
+            try:
+                with open(self._path(segment), 'rb') as f:
+                    pos = f.tell()
+                    for topic, payload, qos, retain in self._records(f):
+                        if self._compact.match(topic):
+                            latest[topic] = (segment, pos)
+                        pos = f.tell()
+            except OSError:
+                pass
+        return latest
+
+    def read(self, count):
+        """Return up to count oldest messages as (topic, payload, qos, retain, segment), empty list when the spool is drained"""
+        with self._lock:
+            self._flush()
+
+            messages = []
+
+            while len(messages) < count:
+                if self._read_file is None:
+                    if not self._segments:
+                        break
+
+                    if self._segments[0] == self._segments[-1] and self._file is not None:
+                        # the segment being written to becomes readable
+                        self._file.close()
+                        self._file = None
+
+                    if self._latest is None and self._compact:
+                        self._latest = self._scan_latest()
+
+                    self._read_segment = self._segments[0]
+                    try:
+                        self._read_file = open(self._path(self._read_segment), 'rb')
+                    except OSError as e:
+                        logging.error('Spool read failed: %s', e)
+                        self._segments.pop(0)
+                        continue
+
+                pos = self._read_file.tell()
+                record = next(self._records(self._read_file), None)
+
+                if record is None:
+                    self._read_file.close()
+                    self._read_file = None
+                    self._segments.pop(0)
+                    self._done.add(self._read_segment)
+                    if not self._unacked.get(self._read_segment):
+                        self._remove(self._read_segment)
+                    continue
+
+                if self._latest and (self._read_segment, pos) < self._latest.get(record[0], (-1, 0)):
+                    continue
+
+                messages.append(record + (self._read_segment,))
+                self._unacked[self._read_segment] = self._unacked.get(self._read_segment, 0) + 1
+
+            if not messages:
+                self.active = False
+                self._latest = None
+            else:
+                self.replayed += len(messages)
+
+            return messages
+
+    def ack(self, segment):
+        """Acknowledge one message of the segment returned by read() as published"""
+        with self._lock:
+            count = self._unacked.get(segment, 0) - 1
+            if count > 0:
+                self._unacked[segment] = count
+                return
+            self._unacked.pop(segment, None)
+            if segment in self._done:
+                self._remove(segment)
+
+    def _remove(self, segment):
+        self._done.discard(segment)
+        try:
+            os.remove(self._path(segment))
+        except OSError:
+            pass
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            if self._read_file is not None:
+                self._read_file.close()
+                self._read_file = None
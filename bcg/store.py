@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import json
+import time
+import atexit
+import logging
+import weakref
+import threading
+from bcg.encoder import json_encode
+
+_stores = weakref.WeakSet()
+
+
+class JSONStore:
+    """JSON file saved in a background thread.
+
+    save() only records the data, the file is written delay seconds after the
+    first unsaved change, so a burst of changes costs one write. The file is
+    replaced atomically (temporary file, fsync, rename) and is not written at
+    all when the content has not changed.
+    """
+
+    def __init__(self, path, delay=2.0):
+        self.path = path
+        self._delay = delay
+        self._content = None
+        self._pending = None
+        self._deadline = None
+        self._cond = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._thread = None
+        _stores.add(self)
+
+    def load(self, default=None):
+        """Return the stored data, default if the file is missing or invalid"""
+        self.flush()
+
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                content = f.read()
+        except FileNotFoundError:
+            return default
+        except OSError as e:
+            logging.warning('Could not read %s: %s', self.path, e)
+            return default
+
+        try:
+            data = json.loads(content)
+        except ValueError as e:
+            logging.warning('Invalid JSON in %s: %s', self.path, e)
+            return default
+
+        self._content = content
+        return data
+
+    def save(self, data):
+        with self._cond:
+            self._pending = data
+            if self._deadline is None:
+                self._deadline = time.monotonic() + self._delay
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='store', daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def flush(self):
+        """Write pending data now"""
+        with self._cond:
+            data = self._pending
+            self._pending = None
+            self._deadline = None
+        if data is not None:
+            self._write(data)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._pending is None or time.monotonic() < self._deadline:
+                    self._cond.wait(None if self._pending is None else self._deadline - time.monotonic())
+                data = self._pending
+                self._pending = None
+                self._deadline = None
+            self._write(data)
+
+    def _write(self, data):
+        with self._write_lock:
+            try:
+                content = json_encode(data)
+            except Exception as e:
+                logging.warning('Could not serialize %s: %s', self.path, e)
+                return
+
+            if content == self._content:
+                return
+
+            tmp = self.path + '.tmp'
+            try:
+                with open(tmp, 'w', encoding='utf-8') as f:
+                    f.write(content)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp, self.path)
+            except OSError as e:
+                logging.warning('Could not write %s: %s', self.path, e)
+                return
+
+            self._content = content
+
+
+@atexit.register
+def _flush_all():
+    for store in list(_stores):
+        store.flush()
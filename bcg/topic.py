@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+def topic_matches(pattern, topic):
+    """Match topic against MQTT subscription pattern with + and # wildcards"""
+    if pattern == topic:
+        return True
+
+    p = pattern.split('/')
+    t = topic.split('/')
+
+    for i, level in enumerate(p):
+        if level == '#':
+            return True
+        if i >= len(t):
+            return False
+        if level != '+' and level != t[i]:
+            return False
+
+    return len(p) == len(t)
+
+
+class TopicMatcher:
+    """First matching pattern wins, the result is cached for every topic"""
+
+    def __init__(self, rules=(), cache_size=65536):
+        self._rules = list(rules)
+        self._cache = {}
+        self._cache_size = cache_size
+
+    def __bool__(self):
+        return bool(self._rules)
+
+    def match(self, topic):
+        """Return value of the first rule (pattern, value) matching topic or None"""
+        try:
+            return self._cache[topic]
+        except KeyError:
+            pass
+
+        value = None
+        for pattern, rule in self._rules:
+            if topic_matches(pattern, topic):
+                value = rule
+                break
+
+        if len(self._cache) >= self._cache_size:
+            self._cache.clear()
+        self._cache[topic] = value
+
+        return value
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# MQTT to serial path of node commands in Gateway.mqtt_on_message: parse and
+# re-encode versus the validated fast path.
+#
+#   python3 benchmark/bench_downlink.py [-m MESSAGES]
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bcg.config import load_config  # noqa: E402
+from bcg.gateway import Gateway  # noqa: E402
+
+COMMANDS = [
+    ('node/kit-1/led/-/state/set', b'true'),
+    ('node/kit-1/relay/-/state/set', b'false'),
+    ('node/836d1983a001/led-strip/-/color/set', b'"#ff0000"'),
+    ('node/836d1983a001/led-strip/-/brightness/set', b'50'),
+    ('node/kit-1/lcd/-/text/set', b'{"x": 5, "y": 10, "text": "Hello", "font": 28}'),
+    ('node/kit-1/thermostat/-/set-point/set', b'21.50'),
+]
+
+
+class Message:
+    __slots__ = ('topic', 'payload')
+
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+class Serial:
+
+    def write(self, data):
+        return len(data)
+
+
+def mqtt_on_message_parsed(gateway, message):
+    # node command path of mqtt_on_message before the fast path
+    payload = json.loads(message.payload.decode('utf-8') or 'null')
+    gateway.write(message.topic[5:], payload)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-m', '--messages', type=int, default=100000)
+    args = parser.parse_args()
+
+    config = load_config(None)
+    config['device'] = '/dev/null'
+    config['rename'] = {'836d1983a000': 'kit-1'}
+
+    gateway = Gateway(config)
+    gateway.ser = Serial()
+    lines = []
+    gateway._downlink.put = lambda topic, line: lines.append(line) or True
+
+    messages = [Message(*COMMANDS[i % len(COMMANDS)]) for i in range(args.messages)]
+
+    for name, handler in (('parsed', lambda message: mqtt_on_message_parsed(gateway, message)),
+                          ('fast', lambda message: gateway.mqtt_on_message(None, None, message))):
+        best = None
+        for _ in range(3):
+            lines.clear()
+            t = time.perf_counter()
+            for message in messages:
+                handler(message)
+            elapsed = time.perf_counter() - t
+            best = elapsed if best is None else min(best, elapsed)
+        print('%-8s %8.3f s %10.0f msgs/s %6.2f us/msg' % (name, best, args.messages / best, best / args.messages * 1e6))
+        for line in lines[:len(COMMANDS)]:
+            print('         %s' % line.decode().rstrip())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# End-to-end throughput of a Gateway: a fake USB dongle on a pty answers the
+# /info, $eeprom/alias/list and /nodes handshake and then sends synthetic radio
+# traffic of N nodes with firmware log lines, the messages are received by a
+# stub MQTT broker (or an in-process sink replacing the MQTT client).
+#
+#   python3 benchmark/bench_e2e.py [-n NODES] [-r RATE] [-d DURATION] [-e ENGINE] [--sink]
+#
+# Every node message carries its sequence number as payload, so the latency
+# is measured from the write to the pty to the publish reaching the broker.
+import os
+import io
+import sys
+import tty
+import json
+import time
+import random
+import socket
+import logging
+import argparse
+import resource
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bcg.config import load_config  # noqa: E402
+from mqtt_stub import MqttStubBroker  # noqa: E402
+
+GATEWAY_ID = '836d19839c3b'
+
+SUBTOPICS = [
+    'thermometer/0:1/temperature',
+    'hygrometer/0:4/relative-humidity',
+    'barometer/0:0/pressure',
+    'lux-meter/0:0/illuminance',
+    'battery/-/voltage',
+    'push-button/-/event-count',
+]
+
+LOG_LINES = [
+    '#{:.3f} <I> Radio pairing request',
+    '#{:.3f} <D> Radio pub 16 bytes',
+    '#{:.3f} <W> Radio buffer full',
+]
+
+
+class FakeDongle:
+    """USB dongle firmware on the master side of a pty"""
+
+    def __init__(self, master, nodes, aliases):
+        self._master = master
+        self._nodes = nodes
+        self._aliases = aliases
+        self._lock = threading.Lock()
+        self.ready = threading.Event()
+        self.received = 0
+
+    def write(self, data):
+        with self._lock:
+            view = memoryview(data)
+            while view:
+                n = os.write(self._master, view)
+                view = view[n:]
+
+    def _reply(self, topic, payload):
+        self.write((json.dumps([topic, payload]) + '\r\n').encode())
+
+    def start(self):
+        threading.Thread(target=self._run, name='dongle', daemon=True).start()
+
+    def _run(self):
+        buffer = b''
+        aliases = sorted(self._aliases.items())
+        while True:
+            try:
+                data = os.read(self._master, 65536)
+            except OSError:
+                return
+            buffer += data
+            while b'\n' in buffer:
+                line, buffer = buffer.split(b'\n', 1)
+                if not line.strip():
+                    continue
+                topic, payload = json.loads(line)
+                self.received += 1
+                if topic == '/info/get':
+                    self._reply('/info', {'id': GATEWAY_ID, 'firmware': 'bcf-gateway-usb-dongle', 'version': 'v1.0.0'})
+                elif topic == '$eeprom/alias/list':
+                    self._reply('$eeprom/alias/list/%d' % payload, dict(aliases[payload * 8:payload * 8 + 8]))
+                elif topic == '/nodes/get':
+                    self._reply('/nodes', self._nodes)
+                    self.ready.set()
+                elif topic == '$eeprom/alias/add':
+                    self._reply('$eeprom/alias/add/ok', payload['id'])
+                elif topic == '$eeprom/alias/remove':
+                    self._reply('$eeprom/alias/remove/ok', payload)
+
+
+def rss_kb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def percentile(values, q):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--nodes', type=int, default=100)
+    parser.add_argument('-r', '--rate', type=float, default=0, help='node messages per second, 0 for as fast as possible')
+    parser.add_argument('-d', '--duration', type=float, default=5.0)
+    parser.add_argument('-e', '--engine', choices=('thread', 'asyncio'), default='thread')
+    parser.add_argument('-l', '--log-ratio', type=float, default=0.05, help='firmware log lines per node message')
+    parser.add_argument('--sink', action='store_true', help='replace the MQTT client by an in-process sink')
+    parser.add_argument('--mqtt5', action='store_true', help='MQTT v5 with topic aliases')
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.CRITICAL)
+
+    random.seed(1)
+    nodes = ['%012x' % (0x836d1983a000 + i) for i in range(args.nodes)]
+    aliases = {node: 'node-%d' % i for i, node in enumerate(nodes) if i % 4 == 0}
+
+    sent = {}
+    latencies = []
+    received = [0, None]
+    total = [0]
+    finished = threading.Event()
+    done = threading.Event()
+
+    def on_publish(topic, payload):
+        now = time.perf_counter()
+        if not topic.startswith('node/'):
+            return
+        t = sent.pop(int(payload), None)
+        if t is None:
+            return
+        latencies.append(now - t)
+        received[0] += 1
+        received[1] = now
+        if received[0] == total[0] and finished.is_set():
+            done.set()
+
+    master, slave = os.openpty()
+    tty.setraw(master)
+    tty.setraw(slave)
+
+    config = load_config(io.StringIO('name: bench\nengine: %s\nmqtt:\n  version: %s\n' % (args.engine, 5 if args.mqtt5 else '3.1.1')))
+    config['device'] = os.ttyname(slave)
+
+    broker = None
+    if not args.sink:
+        s = socket.socket()
+        s.bind(('127.0.0.1', 0))
+        config['mqtt']['port'] = s.getsockname()[1]
+        s.close()
+        broker = MqttStubBroker(port=config['mqtt']['port'], on_publish=lambda topic, payload: on_publish(topic, payload),
+                                topic_alias_maximum=65535).start()
+
+    if args.engine == 'asyncio':
+        from bcg.aio import AsyncioGateway as Gateway
+    else:
+        from bcg.gateway import Gateway
+
+    gateway = Gateway(config)
+    if args.sink:
+        gateway.mqttc.publish = lambda topic, payload=None, qos=0, retain=False, properties=None: on_publish(topic, payload)
+        gateway.mqttc.subscribe = lambda *a, **k: (0, 1)
+        gateway.mqttc.unsubscribe = lambda *a, **k: (0, 1)
+
+    dongle = FakeDongle(master, nodes, aliases)
+    dongle.start()
+
+    rss_start = rss_kb()
+    threading.Thread(target=gateway.start, args=(True,), daemon=True).start()
+
+    if not dongle.ready.wait(10):
+        print('handshake timeout')
+        sys.exit(1)
+    time.sleep(0.5)
+
+    logs = 0
+    chunk = 64
+    interval = chunk / args.rate if args.rate else 0
+    log_acc = 0.0
+
+    t_start = time.perf_counter()
+    t_next = t_start
+    seq = 0
+    while time.perf_counter() - t_start < args.duration:
+        lines = []
+        for _ in range(chunk):
+            lines.append('["%s/%s", %d]\r\n' % (random.choice(nodes), random.choice(SUBTOPICS), seq))
+            seq += 1
+            log_acc += args.log_ratio
+            if log_acc >= 1:
+                log_acc -= 1
+                logs += 1
+                lines.append(random.choice(LOG_LINES).format(time.monotonic()) + '\r\n')
+        now = time.perf_counter()
+        for i in range(seq - chunk, seq):
+            sent[i] = now
+        total[0] = seq
+        dongle.write(''.join(lines).encode())
+        if interval:
+            t_next += interval
+            delay = t_next - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+    t_sent = time.perf_counter()
+    finished.set()
+    # wait for the backlog to drain while messages keep coming
+    last = -1
+    while received[0] < total[0] and received[0] != last:
+        last = received[0]
+        done.wait(3.0)
+
+    elapsed = (received[1] or t_sent) - t_start
+    rss_end = rss_kb()
+
+    print('engine      %s, %s' % (args.engine, 'sink' if args.sink else 'stub broker, MQTT %s' % config['mqtt']['version']))
+    print('nodes       %d, %d aliases' % (args.nodes, len(aliases)))
+    print('sent        %d node messages, %d log lines in %.2f s' % (total[0], logs, t_sent - t_start))
+    print('published   %d node messages (%d lost)' % (received[0], total[0] - received[0]))
+    print('throughput  %.0f msgs/s' % (received[0] / elapsed if elapsed else 0))
+    print('latency     p50 %.3f ms, p99 %.3f ms' % (percentile(latencies, 0.5) * 1e3, percentile(latencies, 0.99) * 1e3))
+    if rss_end is not None:
+        print('rss         %d kB (%+d kB), max %d kB' % (rss_end, rss_end - rss_start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+
+    if broker:
+        print('broker      %d publish bytes, %.1f per message' % (broker.publish_bytes, broker.publish_bytes / broker.packets if broker.packets else 0))
+        broker.stop()
+
+    if received[0] < total[0]:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Compare bcg.encoder.json_encode with the former recursive DecimalJSONEncoder
+# on payloads as they come from the radio.
+#
+#   python3 benchmark/bench_encoder.py [-n NUMBER]
+import os
+import sys
+import json
+import decimal
+import timeit
+import argparse
+from collections.abc import Mapping, Iterable
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bcg.encoder import json_encode  # noqa: E402
+
+
+class DecimalJSONEncoder(json.JSONEncoder):
+    """Encoder used by bcg.gateway before json_encode"""
+    def encode(self, obj):
+        if isinstance(obj, Mapping):
+            return '{' + ', '.join(f'{self.encode(k)}: {self.encode(v)}' for (k, v) in obj.items()) + '}'
+        if isinstance(obj, Iterable) and (not isinstance(obj, str)):
+            return '[' + ', '.join(map(self.encode, obj)) + ']'
+        if isinstance(obj, decimal.Decimal):
+            return f'{obj.normalize():f}'
+        return super().encode(obj)
+
+
+def load(line):
+    return json.loads(line, parse_float=decimal.Decimal)
+
+
+PAYLOADS = {
+    'temperature': load('21.50'),
+    'integer': load('1'),
+    'string': load('"push"'),
+    'null': None,
+    'bool': True,
+    'frame': load('["836d19839c3b/thermometer/0:1/temperature", 23.19]'),
+    'info': load('{"firmware": "bcf-kit-wireless-climate-monitor", "version": "v1.10.0"}'),
+    'lcd': load('{"text": "Hello", "x": 5, "y": 10, "font": 28, "color": true}'),
+    'nodes': load(json.dumps([{"id": "%012x" % i, "alias": "climate-monitor:%d" % i,
+                               "firmware": "bcf-kit-wireless-climate-monitor", "version": "v1.10.0"} for i in range(16)])),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--number', type=int, default=100000)
+    args = parser.parse_args()
+
+    encoder = DecimalJSONEncoder()
+
+    print('%-12s %12s %12s %8s' % ('payload', 'old [us]', 'new [us]', 'speedup'))
+    for name, payload in PAYLOADS.items():
+        old_out = json.dumps(payload, cls=DecimalJSONEncoder)
+        new_out = json_encode(payload)
+        if old_out != new_out:
+            print('output mismatch for %s:\n  old %s\n  new %s' % (name, old_out, new_out))
+            sys.exit(1)
+
+        number = args.number if name != 'nodes' else max(args.number // 20, 1)
+        old = min(timeit.repeat(lambda: encoder.encode(payload), number=number, repeat=3)) / number
+        new = min(timeit.repeat(lambda: json_encode(payload), number=number, repeat=3)) / number
+        print('%-12s %12.3f %12.3f %7.1fx' % (name, old * 1e6, new * 1e6, old / new))
+
+
+if __name__ == '__main__':
+    main()
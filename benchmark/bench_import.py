@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Startup time of the bcg command line, measured with python -X importtime.
+# Fails when a command loads a module it should not need.
+#
+#   python3 benchmark/bench_import.py [-n REPEAT]
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+HEAVY = ('paho', 'yaml', 'schema', 'serial', 'appdirs', 'looseversion', 'bcg.gateway', 'bcg.config')
+
+COMMANDS = [
+    # arguments, heavy modules the command is allowed to load
+    (None, ()),
+    (['--version'], ()),
+    (['--help'], ()),
+    (['devices'], ('serial', 'looseversion')),
+    (['replay', '--help'], ()),
+]
+
+
+def run(args):
+    if args is None:
+        code = 'import bcg'
+    else:
+        code = 'import sys; sys.argv = %r; import bcg; bcg.main()' % (['bcg'] + args)
+
+    t = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=ROOT,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    elapsed = time.perf_counter() - t
+
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative_us, name = line.split('|')
+        modules[name.strip()] = int(cumulative_us)
+
+    return elapsed, modules
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    failed = False
+
+    for command, allowed in COMMANDS:
+        best = None
+        for _ in range(args.repeat):
+            elapsed, modules = run(command)
+            best = elapsed if best is None else min(best, elapsed)
+
+        unexpected = sorted(set(name.split('.')[0] if not name.startswith('bcg.') else name
+                                for name in modules
+                                if name.startswith(HEAVY) and not name.startswith(allowed)))
+
+        name = 'import bcg' if command is None else 'bcg ' + ' '.join(command)
+        print('%-20s %7.1f ms  bcg imports %6.1f ms  %3d modules%s' % (
+            name, best * 1e3, modules.get('bcg', 0) / 1e3, len(modules),
+            '  UNEXPECTED: ' + ', '.join(unexpected) if unexpected else ''))
+
+        failed = failed or bool(unexpected)
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Memory and lookups of the node registry versus the dict of dicts with the
+# parallel rename and alias dicts it replaced.
+#
+#   python3 benchmark/bench_nodes.py [-n NODES] [-m MESSAGES]
+import os
+import sys
+import time
+import random
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bcg.nodes import NodeRegistry  # noqa: E402
+
+INFO = {'firmware': 'bcf-kit-wireless-climate-monitor', 'version': 'v1.4.0'}
+
+
+def build_dicts(addresses, names):
+    nodes = {}
+    rename_id = {}
+    rename_name = {}
+    alias_list = {}
+    counts = {}
+    for i, address in enumerate(addresses):
+        nodes[address] = {'info': INFO}
+        name = names[i]
+        rename_id[address] = name
+        rename_name[name] = address
+        alias_list[address] = name
+        counts[address] = 0
+    return nodes, rename_id, rename_name, alias_list, counts
+
+
+def build_registry(addresses, names):
+    registry = NodeRegistry()
+    for i, address in enumerate(addresses):
+        registry.attach(address)
+        registry.set_info(address, INFO)
+        name = names[i]
+        registry.set_alias(address, name)
+        registry.set_eeprom_alias(address, name)
+    return registry
+
+
+def measure(build, addresses, names):
+    tracemalloc.start()
+    result = build(addresses, names)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--nodes', type=int, default=5000)
+    parser.add_argument('-m', '--messages', type=int, default=200000)
+    args = parser.parse_args()
+
+    # strings allocated up front so both measurements count only the containers
+    addresses = ['%012x' % (0x836d19830000 + i) for i in range(args.nodes)]
+    names = ['climate-monitor:%d' % i for i in range(args.nodes)]
+
+    (nodes, rename_id, rename_name, alias_list, counts), dicts_size = measure(build_dicts, addresses, names)
+    registry, registry_size = measure(build_registry, addresses, names)
+
+    print('%-10s %8.1f kB %6.0f B/node' % ('dicts', dicts_size / 1024, dicts_size / args.nodes))
+    print('%-10s %8.1f kB %6.0f B/node' % ('registry', registry_size / 1024, registry_size / args.nodes))
+
+    random.seed(1)
+    messages = [random.choice(addresses) for _ in range(args.messages)]
+    commands = [random.choice(names) for _ in range(args.messages)]
+
+    def dicts_run():
+        for address in messages:
+            counts[address] += 1
+            rename_id.get(address)
+        for name in commands:
+            rename_name.get(name)
+
+    def registry_run():
+        for address in messages:
+            registry.seen(address, 0.0)
+            registry.alias(address)
+        for name in commands:
+            registry.address(name)
+
+    for name, run in (('dicts', dicts_run), ('registry', registry_run)):
+        best = None
+        for _ in range(3):
+            t = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - t
+            best = elapsed if best is None else min(best, elapsed)
+        print('%-10s %8.3f s %6.3f us/lookup' % (name, best, best / (args.messages * 2) * 1e6))
+
+
+if __name__ == '__main__':
+    main()
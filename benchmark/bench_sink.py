@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Write rate and size on disk of the local sink, and export of the whole
+# sink versus a one hour range.
+#
+#   python3 benchmark/bench_sink.py [-n NODES] [-m MESSAGES]
+import os
+import sys
+import time
+import random
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bcg.sink import Sink, export  # noqa: E402
+
+TOPICS = ('thermometer/0:1/temperature', 'hygrometer/0:4/relative-humidity', 'barometer/0:0/pressure', 'battery/-/voltage')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--nodes', type=int, default=100)
+    parser.add_argument('-m', '--messages', type=int, default=500000)
+    args = parser.parse_args()
+
+    random.seed(1)
+    addresses = ['%012x' % (0x836d19830000 + i) for i in range(args.nodes)]
+    messages = [(random.choice(addresses), random.choice(TOPICS), '%.2f' % random.uniform(0, 100)) for _ in range(args.messages)]
+    # one message every 0.1 s from the start of the day
+    start = 1700000000.0
+
+    directory = tempfile.mkdtemp(prefix='bench-sink-')
+    try:
+        sink = Sink(directory, sync_interval=5.0, segment_time=3600)
+        t = time.perf_counter()
+        for i, (address, subtopic, payload) in enumerate(messages):
+            sink.add(address, None, subtopic, payload, start + i * 0.1)
+        sink.close()
+        elapsed = time.perf_counter() - t
+
+        size = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+        raw = sum(len(line) for line in export(directory))
+        print('write     %8.0f msgs/s %6.1f B/msg on disk, %5.1f B/msg NDJSON, %d segments'
+              % (args.messages / elapsed, size / args.messages, raw / args.messages, len(os.listdir(directory))))
+
+        middle = start + args.messages * 0.05
+        for name, since, until in (('all', None, None), ('1 hour', middle, middle + 3600)):
+            t = time.perf_counter()
+            count = sum(1 for _ in export(directory, since, until))
+            elapsed = time.perf_counter() - t
+            print('export %-6s %8d lines %8.3f s %10.0f lines/s' % (name, count, elapsed, count / elapsed))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# MQTT topic of a node message with and without the per-node topic cache,
+# Gateway._node_topic only, without the rest of the publish path.
+#
+#   python3 benchmark/bench_topic_cache.py [-m MESSAGES] [-n NODES]
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bcg.config import load_config  # noqa: E402
+from bcg.gateway import Gateway  # noqa: E402
+
+SUBTOPICS = [
+    'thermometer/0:1/temperature',
+    'hygrometer/0:4/relative-humidity',
+    'barometer/0:0/pressure',
+    'lux-meter/0:0/illuminance',
+    'battery/-/voltage',
+]
+
+
+def node_topic_uncached(gateway, subtopic):
+    # node_message before the topic cache
+    node_ide, topic = subtopic.split('/', 1)
+    node_name = gateway._nodes.alias(node_ide)
+    if node_name:
+        subtopic = node_name + '/' + topic
+    return gateway._config['base_topic_prefix'] + "node/" + subtopic
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-m', '--messages', type=int, default=100000)
+    parser.add_argument('-n', '--nodes', type=int, default=500)
+    args = parser.parse_args()
+
+    config = load_config(None)
+    config['device'] = '/dev/null'
+    config['base_topic_prefix'] = 'home-'
+    config['rename'] = {'%012x' % i: 'climate-monitor:%d' % i for i in range(0, args.nodes, 2)}
+
+    gateway = Gateway(config)
+
+    random.seed(1)
+    messages = ['%012x/%s' % (random.randrange(args.nodes), random.choice(SUBTOPICS)) for _ in range(args.messages)]
+
+    results = {}
+    for name, handler in (('uncached', lambda subtopic: node_topic_uncached(gateway, subtopic)),
+                          ('cached', gateway._node_topic)):
+        best = None
+        for _ in range(3):
+            gateway._topic_cache_clear()
+            t = time.perf_counter()
+            topics = [handler(subtopic) for subtopic in messages]
+            elapsed = time.perf_counter() - t
+            best = elapsed if best is None else min(best, elapsed)
+        results[name] = topics
+        print('%-10s %8.3f s %10.0f msgs/s %6.2f us/msg' % (name, best, args.messages / best, best / args.messages * 1e6))
+
+    if results['cached'] != results['uncached']:
+        print('topic mismatch')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Minimal in-process MQTT broker for the benchmarks: acknowledges everything,
+# records publishes and forwards them with QoS 0 to matching subscribers.
+# MQTT v5 clients may use up to topic_alias_maximum topic aliases.
+import socket
+import struct
+import threading
+import socketserver
+
+from bcg.topic import topic_matches
+
+
+def _read_exact(sock, n):
+    data = b''
+    while len(data) < n:
+        chunk = sock.recv(n - len(data))
+        if not chunk:
+            raise ConnectionError
+        data += chunk
+    return data
+
+
+def _remaining_length(n):
+    out = bytearray()
+    while True:
+        b = n % 128
+        n //= 128
+        if n:
+            b |= 0x80
+        out.append(b)
+        if not n:
+            return bytes(out)
+
+
+def _string(data, i):
+    n = struct.unpack_from('!H', data, i)[0]
+    return data[i + 2:i + 2 + n].decode('utf-8'), i + 2 + n
+
+
+def _varint(data, i):
+    value = 0
+    mult = 1
+    while True:
+        b = data[i]
+        i += 1
+        value += (b & 0x7f) * mult
+        mult *= 128
+        if not b & 0x80:
+            return value, i
+
+
+class _Handler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        broker = self.server.broker
+        sock = self.request
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.v5 = False
+        self.aliases = {}
+        self.lock = threading.Lock()
+        broker._add(self)
+        try:
+            while True:
+                header = _read_exact(sock, 1)[0]
+                length = 0
+                mult = 1
+                while True:
+                    b = _read_exact(sock, 1)[0]
+                    length += (b & 0x7f) * mult
+                    mult *= 128
+                    if not b & 0x80:
+                        break
+                data = _read_exact(sock, length) if length else b''
+                if not self.packet(broker, header >> 4, header & 0x0f, data):
+                    break
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            broker._remove(self)
+
+    def send(self, data):
+        with self.lock:
+            try:
+                self.request.sendall(data)
+            except OSError:
+                pass
+
+    def packet(self, broker, ptype, flags, data):
+        if ptype == 1:  # CONNECT
+            self.v5 = data[6] == 5
+            if not self.v5:
+                self.send(b'\x20\x02\x00\x00')
+            elif broker.topic_alias_maximum:
+                self.send(b'\x20\x06\x00\x00\x03\x22' + struct.pack('!H', broker.topic_alias_maximum))
+            else:
+                self.send(b'\x20\x03\x00\x00\x00')
+        elif ptype == 3:  # PUBLISH
+            broker.publish_bytes += len(data)
+            qos = (flags >> 1) & 3
+            topic, i = _string(data, 0)
+            mid = None
+            if qos:
+                mid = data[i:i + 2]
+                i += 2
+            if self.v5:
+                plen, j = _varint(data, i)
+                props = data[j:j + plen]
+                i = j + plen
+                k = 0
+                while k < len(props):
+                    pid = props[k]
+                    if pid == 0x23:  # topic alias
+                        alias = struct.unpack_from('!H', props, k + 1)[0]
+                        if not 0 < alias <= broker.topic_alias_maximum:
+                            broker.alias_errors += 1
+                        elif topic:
+                            self.aliases[alias] = topic
+                        else:
+                            topic = self.aliases.get(alias, '')
+                        k += 3
+                    elif pid == 0x02:  # message expiry
+                        k += 5
+                    else:
+                        break
+            broker._publish(topic, data[i:], bool(flags & 1), self)
+            if qos == 1:
+                self.send(b'\x40\x02' + mid)
+            elif qos == 2:
+                self.send(b'\x50\x02' + mid)
+        elif ptype == 6:  # PUBREL
+            self.send(b'\x70\x02' + data[:2])
+        elif ptype == 8:  # SUBSCRIBE
+            mid = data[:2]
+            i = 2
+            if self.v5:
+                plen, i = _varint(data, i)
+                i += plen
+            codes = b''
+            while i < len(data):
+                topic, i = _string(data, i)
+                broker._subscribe(self, topic)
+                i += 1
+                codes += b'\x00'
+            body = mid + (b'\x00' if self.v5 else b'') + codes
+            self.send(b'\x90' + _remaining_length(len(body)) + body)
+        elif ptype == 10:  # UNSUBSCRIBE
+            mid = data[:2]
+            i = 2
+            if self.v5:
+                plen, i = _varint(data, i)
+                i += plen
+            count = 0
+            while i < len(data):
+                topic, i = _string(data, i)
+                broker._unsubscribe(self, topic)
+                count += 1
+            body = mid + (b'\x00' + b'\x00' * count if self.v5 else b'')
+            self.send(b'\xb0' + _remaining_length(len(body)) + body)
+        elif ptype == 12:  # PINGREQ
+            self.send(b'\xd0\x00')
+        elif ptype == 14:  # DISCONNECT
+            return False
+        return True
+
+
+class MqttStubBroker(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=0, on_publish=None, topic_alias_maximum=0):
+        super().__init__((host, port), _Handler)
+        self.broker = self
+        self.on_publish = on_publish
+        self.topic_alias_maximum = topic_alias_maximum
+        self.packets = 0
+        self.publish_bytes = 0
+        self.alias_errors = 0
+        self._clients = set()
+        self._subs = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def _add(self, client):
+        with self._lock:
+            self._clients.add(client)
+            self._subs[client] = set()
+
+    def _remove(self, client):
+        with self._lock:
+            self._clients.discard(client)
+            self._subs.pop(client, None)
+
+    def _subscribe(self, client, topic):
+        with self._lock:
+            self._subs[client].add(topic)
+
+    def _unsubscribe(self, client, topic):
+        with self._lock:
+            self._subs[client].discard(topic)
+
+    def subscriptions(self):
+        with self._lock:
+            return set().union(*self._subs.values()) if self._subs else set()
+
+    def _publish(self, topic, payload, retain, sender):
+        self.packets += 1
+        if self.on_publish:
+            self.on_publish(topic, payload)
+        with self._lock:
+            targets = [c for c, subs in self._subs.items() if any(topic_matches(s, topic) for s in subs)]
+        for client in targets:
+            if client.v5:
+                body = struct.pack('!H', len(topic.encode())) + topic.encode() + b'\x00' + payload
+            else:
+                body = struct.pack('!H', len(topic.encode())) + topic.encode() + payload
+            client.send(b'\x30' + _remaining_length(len(body)) + body)
+
+    def inject(self, topic, payload):
+        """Publish a message to subscribers as if it came from another client"""
+        self._publish(topic, payload, False, None)